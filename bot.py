@@ -1,26 +1,48 @@
 import os
 import re
 import json
+import time
+import signal
+import socket
+import secrets
 import asyncio
+import functools
+import contextvars
+import threading
 import logging
 import datetime
 import html as html_mod
-from threading import Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+from aiogram.methods import GetUpdates
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 import gspread
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
 import aiohttp
 
+from journal import SheetsJournal
+from search_stats import SearchStats
+from plate_index import PlateIndex
+from snapshot_file import write_snapshot, read_version, MappedSnapshot
+from fsm_storage import SQLiteStorage
+from logging_setup import setup_logging
+
 # ======== НАСТРОЙКИ ========
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 SPREADSHEET_ID = os.environ.get('SPREADSHEET_ID')
 SHEET_NAME = os.environ.get('SHEET_NAME', 'Лист1')
+# Несколько парковок в одном процессе — JSON-список вместо SPREADSHEET_ID:
+# [{"id": "north", "title": "Северная", "spreadsheet_id": "...", "sheet_name": "Лист1"}, ...]
+LOTS_JSON = os.environ.get('LOTS', '')
 GOOGLE_CREDS_JSON = os.environ.get('GOOGLE_CREDS_JSON')
 
 # Имена листов
@@ -31,51 +53,247 @@ SEARCH_SHEET_NAME = 'Поиски'
 ADMIN_IDS_STR = os.environ.get('ADMIN_IDS', '')
 ADMIN_IDS = [int(x.strip()) for x in ADMIN_IDS_STR.split(',') if x.strip().isdigit()]
 
-if not TELEGRAM_TOKEN or not SPREADSHEET_ID or not GOOGLE_CREDS_JSON:
+# HTTP-сервер и вебхук. Без WEBHOOK_URL бот работает через long polling
+WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.environ.get('WEB_PORT', 8080))
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+# Без заданного секрета генерируется случайный на каждый запуск (передаётся в set_webhook):
+# иначе любой, кто угадал WEBHOOK_PATH, мог бы прислать апдейт от имени админа
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', 20))
+# Сколько апдейтов может быть принято (в обработке + в очереди), дальше — backpressure
+MAX_PENDING_UPDATES = int(os.environ.get('MAX_PENDING_UPDATES', 100))
+# Потоки для запросов к Google Sheets; тяжёлые задачи (перестройка кэша,
+# админские чистки) занимают не больше BULK_SHEETS_WORKERS из них
+SHEETS_WORKERS = int(os.environ.get('SHEETS_WORKERS', 8))
+BULK_SHEETS_WORKERS = int(os.environ.get('BULK_SHEETS_WORKERS', max(1, SHEETS_WORKERS // 4)))
+# Антифлуд: "запас/в минуту" для каждого класса запросов (админы не ограничены)
+THROTTLE_SEARCH = os.environ.get('THROTTLE_SEARCH', '8/20')
+THROTTLE_PAGINATION = os.environ.get('THROTTLE_PAGINATION', '10/60')
+THROTTLE_REGISTRATION = os.environ.get('THROTTLE_REGISTRATION', '3/6')
+THROTTLE_MAX_DELAY = float(os.environ.get('THROTTLE_MAX_DELAY', 1.0))  # сек: дольше — отказ
+THROTTLE_MAX_USERS = int(os.environ.get('THROTTLE_MAX_USERS', 10000))
+# Уведомления админам: общий лимит сообщений в секунду и пауза между
+# сообщениями в один чат (всё, что накопилось за паузу, уходит одной сводкой)
+NOTIFY_RATE = float(os.environ.get('NOTIFY_RATE', 25))
+NOTIFY_CHAT_INTERVAL = float(os.environ.get('NOTIFY_CHAT_INTERVAL', 10))
+# Локальные данные бота (журнал записей и т.п.)
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+# Журнал записей в Sheets: fsync раз в N сек, отправка пачками раз в M сек
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', 1.0))
+JOURNAL_REPLAY_INTERVAL = float(os.environ.get('JOURNAL_REPLAY_INTERVAL', 5.0))
+JOURNAL_BATCH_SIZE = int(os.environ.get('JOURNAL_BATCH_SIZE', 500))
+# Запись состояний FSM на диск раз в N сек
+FSM_FLUSH_INTERVAL = float(os.environ.get('FSM_FLUSH_INTERVAL', 2.0))
+# Сохранение статистики поисков на диск раз в N сек
+STATS_SAVE_INTERVAL = float(os.environ.get('STATS_SAVE_INTERVAL', 30))
+# Автоочистка поисков старше N дней раз в сутки (0 — выключена)
+SEARCH_RETENTION_DAYS = int(os.environ.get('SEARCH_RETENTION_DAYS', 0))
+# Сколько последних регистраций/поисков держать в памяти для админских команд
+RECENT_BUFFER_SIZE = int(os.environ.get('RECENT_BUFFER_SIZE', 200))
+# Снимок базы жильцов перечитывается не чаще раза в N сек
+RESIDENTS_TTL = float(os.environ.get('RESIDENTS_TTL', 60))
+# Снимок жильцов в файле для других процессов (web_server.py):
+# write — читать Sheets и писать файл, read — только читать файл, off — без файла.
+# С LOTS у каждой парковки свой файл DATA_DIR/<id>/residents.snap
+RESIDENTS_SNAPSHOT_MODE = os.environ.get('RESIDENTS_SNAPSHOT_MODE', 'write')
+RESIDENTS_SNAPSHOT_FILE = os.environ.get('RESIDENTS_SNAPSHOT_FILE', os.path.join(DATA_DIR, 'residents.snap'))
+RESIDENTS_SNAPSHOT_POLL = float(os.environ.get('RESIDENTS_SNAPSHOT_POLL', 2.0))  # сек: проверка файла в режиме read
+# Результатов поиска в LRU-кэше (по нормализованному запросу)
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 500))
+# Inline-режим (@bot А12): пауза на набор, кэш ответа у Telegram, число подсказок
+INLINE_DEBOUNCE = float(os.environ.get('INLINE_DEBOUNCE', 0.3))
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', 60))
+INLINE_MAX_RESULTS = int(os.environ.get('INLINE_MAX_RESULTS', 20))
+# Нечёткий поиск, если точных совпадений нет (0 — выключить)
+FUZZY_SEARCH = os.environ.get('FUZZY_SEARCH', '1') == '1'
+FUZZY_MAX_COST = float(os.environ.get('FUZZY_MAX_COST', 1.0))  # 1.0 — одна любая опечатка
+FUZZY_MAX_RESULTS = int(os.environ.get('FUZZY_MAX_RESULTS', 10))
+# Контроль здоровья: проверки раз в HEALTH_MIN_INTERVAL..HEALTH_INTERVAL сек
+HEALTH_INTERVAL = float(os.environ.get('HEALTH_INTERVAL', 120))
+HEALTH_MIN_INTERVAL = float(os.environ.get('HEALTH_MIN_INTERVAL', 10))
+HEALTH_MAX_FAILURES = int(os.environ.get('HEALTH_MAX_FAILURES', 5))  # ошибок Telegram до пересоздания сессии
+HEALTH_UNHEALTHY_TIMEOUT = float(os.environ.get('HEALTH_UNHEALTHY_TIMEOUT', 600))  # сек без Telegram до рестарта systemd
+HEALTH_EXTERNAL_URL = os.environ.get('HEALTH_EXTERNAL_URL', '').rstrip('/')
+# Логи: уровень, формат (json или text) и доля записываемых частых INFO-событий
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_SEARCH_SAMPLE = float(os.environ.get('LOG_SEARCH_SAMPLE', 0.1))   # поиски
+LOG_UPDATE_SAMPLE = float(os.environ.get('LOG_UPDATE_SAMPLE', 0.1))   # "Update id=... is handled" от aiogram
+# Токен для HTTP API /search (без него эндпоинт выключен)
+API_TOKEN = os.environ.get('API_TOKEN', '')
+
+if not TELEGRAM_TOKEN or not (SPREADSHEET_ID or LOTS_JSON) or not GOOGLE_CREDS_JSON:
     raise ValueError("Отсутствуют обязательные переменные окружения!")
 
+
+def parse_lots(value: str) -> list:
+    """Описания парковок из LOTS. Без LOTS — одна парковка из SPREADSHEET_ID,
+    её файлы остаются прямо в DATA_DIR, как до появления LOTS."""
+    if not value:
+        return [{'id': 'main', 'title': '', 'spreadsheet_id': SPREADSHEET_ID,
+                 'sheet_name': SHEET_NAME, 'data_dir': DATA_DIR,
+                 'snapshot_file': RESIDENTS_SNAPSHOT_FILE}]
+    lots = []
+    for item in json.loads(value):
+        lot_id = str(item['id'])
+        if not re.fullmatch(r'[\w-]+', lot_id) or any(lot['id'] == lot_id for lot in lots):
+            raise ValueError(f"LOTS: недопустимый или повторный id парковки '{lot_id}'")
+        data_dir = os.path.join(DATA_DIR, lot_id)
+        lots.append({'id': lot_id, 'title': item.get('title') or lot_id,
+                     'spreadsheet_id': item['spreadsheet_id'],
+                     'sheet_name': item.get('sheet_name', SHEET_NAME), 'data_dir': data_dir,
+                     'snapshot_file': os.path.join(data_dir, 'residents.snap')})
+    if not lots:
+        raise ValueError("LOTS: пустой список парковок")
+    return lots
+
+
+LOT_CONFIGS = parse_lots(LOTS_JSON)
+
 # ======== ЛОГИРОВАНИЕ ========
-logging.basicConfig(level=logging.INFO)
+# Форматирование и запись — в отдельном потоке (см. logging_setup.py)
+setup_logging(LOG_LEVEL, LOG_FORMAT, {'search': LOG_SEARCH_SAMPLE, 'aiogram.event': LOG_UPDATE_SAMPLE})
 logger = logging.getLogger(__name__)
 
-# ======== HEALTH-СЕРВЕР ДЛЯ RENDER ========
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b'OK')
-        elif self.path == '/ping':
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b'PONG')
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def log_message(self, format, *args):
-        pass
+# ======== МЕТРИКИ ========
+# Счётчики для /metrics (формат Prometheus)
+METRICS = Counter()
+STARTED_AT = time.monotonic()
 
+# ======== ИНИЦИАЛИЗАЦИЯ ========
+bot = Bot(token=TELEGRAM_TOKEN)
+os.makedirs(DATA_DIR, exist_ok=True)
+# Состояния переживают рестарт — жителям не нужно заново регистрироваться
+# Процесс-читатель снимка (web_server.py) не обрабатывает апдейты и не трогает файл бота
+storage = SQLiteStorage(':memory:' if RESIDENTS_SNAPSHOT_MODE == 'read'
+                        else os.path.join(DATA_DIR, 'fsm.sqlite3'))
+dp = Dispatcher(storage=storage)
 
-def run_health_server():
-    server = HTTPServer(('0.0.0.0', 8080), HealthHandler)
-    logger.info("🏥 Health-сервер запущен на порту 8080")
-    server.serve_forever()
+class UpdateGate:
+    """Допуск апдейтов в обработку.
 
+    Не больше max_active апдейтов обрабатываются одновременно, не больше
+    max_pending приняты вообще (в обработке + ждут слота). Когда очередь
+    полна, новые апдейты не забираются у Telegram: в polling-режиме
+    задерживается getUpdates, в webhook-режиме — ответ на запрос.
+    Ожидание внутри обработки (дебаунс, задержка троттлинга) идёт через
+    sleep() — на это время слот отдаётся другим апдейтам.
+    """
 
-health_thread = Thread(target=run_health_server, daemon=True)
-health_thread.start()
+    def __init__(self, max_active: int, max_pending: int):
+        self.max_active = max_active
+        self.max_pending = max(max_pending, max_active)
+        self.active = 0
+        self.pending = 0
+        self._slots = asyncio.Semaphore(max_active)
+        self._has_capacity = asyncio.Event()
+        self._has_capacity.set()
+        # Держит ли текущая задача слот (апдейт внутри run())
+        self._holding = contextvars.ContextVar('update_gate_holding', default=False)
+
+    @property
+    def free(self) -> int:
+        return max(0, self.max_pending - self.pending)
+
+    async def wait_for_capacity(self) -> int:
+        # Даём только что созданным задачам дойти до admit()
+        await asyncio.sleep(0)
+        while self.pending >= self.max_pending:
+            METRICS['updates_backpressure_waits'] += 1
+            self._has_capacity.clear()
+            await self._has_capacity.wait()
+        return self.free
+
+    async def sleep(self, delay: float):
+        """asyncio.sleep, не занимающий слот обработки"""
+        if not self._holding.get():
+            await asyncio.sleep(delay)
+            return
+        self.active -= 1
+        self._slots.release()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            # shield: даже при отмене слот будет взят обратно, и run()
+            # отпустит его ровно один раз
+            self.active += 1
+            await asyncio.shield(self._slots.acquire())
+
+    async def drain(self, timeout: float):
+        """Ждёт, пока доработают принятые апдейты (не дольше timeout)"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.pending
+
+    async def run(self, handler, event, data):
+        self.pending += 1
+        try:
+            async with self._slots:
+                self.active += 1
+                holding = self._holding.set(True)
+                try:
+                    return await handler(event, data)
+                finally:
+                    self._holding.reset(holding)
+                    self.active -= 1
+        finally:
+            self.pending -= 1
+            if self.pending < self.max_pending:
+                self._has_capacity.set()
 
-# ======== ИНИЦИАЛИЗАЦИЯ ========
-bot = Bot(token=TELEGRAM_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+
+UPDATE_GATE = UpdateGate(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+
+
+@dp.update.outer_middleware()
+async def limit_update_concurrency(handler, event, data):
+    try:
+        return await UPDATE_GATE.run(handler, event, data)
+    except Exception:
+        METRICS['updates_failed'] += 1
+        raise
+    finally:
+        METRICS['updates_total'] += 1
+
+
+@bot.session.middleware
+async def polling_backpressure(make_request, bot, method):
+    """Не забирает новую пачку апдейтов, пока очередь обработки полна"""
+    if isinstance(method, GetUpdates):
+        free = await UPDATE_GATE.wait_for_capacity()
+        # aiogram переиспользует один объект GetUpdates на весь polling:
+        # меняем копию, иначе однажды урезанный limit так и останется маленьким
+        method = method.model_copy(update={'limit': min(method.limit or 100, free)})
+    return await make_request(bot, method)
+
+
+# Отдельный пул для Google Sheets, чтобы не делить default executor
+SHEETS_EXECUTOR = ThreadPoolExecutor(max_workers=SHEETS_WORKERS, thread_name_prefix='sheets')
+BULK_SHEETS_SLOTS = asyncio.Semaphore(BULK_SHEETS_WORKERS)
+BULK_SHEETS_ACTIVE = 0
 
 
 async def sheets_call(func, *args, **kwargs):
     """Выполняет синхронный вызов gspread в отдельном потоке,
     чтобы не блокировать event loop бота."""
-    return await asyncio.to_thread(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(SHEETS_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+async def bulk_sheets_call(func, *args, **kwargs):
+    """То же для тяжёлых задач (полные перечитывания листов, массовые удаления):
+    они ждут своей очереди и не вытесняют поиски жильцов."""
+    global BULK_SHEETS_ACTIVE
+    async with BULK_SHEETS_SLOTS:
+        METRICS['sheets_bulk_calls'] += 1
+        BULK_SHEETS_ACTIVE += 1
+        try:
+            return await sheets_call(func, *args, **kwargs)
+        finally:
+            BULK_SHEETS_ACTIVE -= 1
 
 # ======== КОНСТАНТЫ ========
 RESULTS_PER_PAGE = 5
@@ -88,111 +306,84 @@ RUS_TO_ENG = {
 ENG_TO_RUS = {v: k for k, v in RUS_TO_ENG.items()}
 
 # ======== ПОДКЛЮЧЕНИЕ GOOGLE SHEETS ========
+REG_HEADER = ['Дата', 'Telegram ID', 'Username', 'ФИО', 'Телефон', 'Имя в TG']
+SEARCH_HEADER = ['Дата', 'Telegram ID', 'Username', 'Имя в TG', 'Запрос', 'Найдено', 'ID владельцев']
+
+
+def col_letter(col: int) -> str:
+    return chr(ord('A') + col - 1)
+
+
+def ensure_worksheet(spreadsheet, title: str, header: list, color: dict, rows: int = 1000):
+    """Открывает лист, а если его нет — создаёт с жирной цветной шапкой"""
+    try:
+        return spreadsheet.worksheet(title)
+    except gspread.WorksheetNotFound:
+        ws = spreadsheet.add_worksheet(title=title, rows=rows, cols=len(header))
+        ws.append_row(header)
+        ws.format(f'A1:{col_letter(len(header))}1', {
+            'textFormat': {'bold': True},
+            'backgroundColor': color
+        })
+        logger.info(f"📄 Создан лист '{title}'")
+        return ws
+
+
+class PooledHTTPClient(gspread.HTTPClient):
+    """HTTP-клиент gspread с пулом соединений на все потоки SHEETS_EXECUTOR
+    (requests по умолчанию держит не больше 10 соединений на хост)"""
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=max(SHEETS_WORKERS, 10)))
+
+
 def init_gsheets():
+    """Один авторизованный клиент на все парковки"""
     try:
         creds_dict = json.loads(GOOGLE_CREDS_JSON)
         scope = ['https://spreadsheets.google.com/feeds',
                  'https://www.googleapis.com/auth/drive']
         creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
-        main_sheet = spreadsheet.worksheet(SHEET_NAME)
+        return gspread.authorize(creds, http_client=PooledHTTPClient)
+    except Exception as e:
+        logger.error(f"❌ Ошибка авторизации в Google Sheets: {e}")
+        raise
+
+
+def open_lot_sheets(client, spreadsheet_id: str, sheet_name: str):
+    try:
+        spreadsheet = client.open_by_key(spreadsheet_id)
+        main_sheet = spreadsheet.worksheet(sheet_name)
         
         # Лист "Регистрации"
-        try:
-            reg_sheet = spreadsheet.worksheet(REG_SHEET_NAME)
-        except gspread.WorksheetNotFound:
-            reg_sheet = spreadsheet.add_worksheet(title=REG_SHEET_NAME, rows=1000, cols=6)
-            reg_sheet.append_row([
-                'Дата', 'Telegram ID', 'Username', 'ФИО', 'Телефон', 'Имя в TG'
-            ])
-            reg_sheet.format('A1:F1', {
-                'textFormat': {'bold': True},
-                'backgroundColor': {'red': 0.7, 'green': 0.85, 'blue': 1.0}
-            })
-            logger.info(f"📄 Создан лист '{REG_SHEET_NAME}'")
-        
-        # Лист "Поиски"
-        try:
-            search_sheet = spreadsheet.worksheet(SEARCH_SHEET_NAME)
-        except gspread.WorksheetNotFound:
-            search_sheet = spreadsheet.add_worksheet(title=SEARCH_SHEET_NAME, rows=5000, cols=7)
-            search_sheet.append_row([
-                'Дата', 'Telegram ID', 'Username', 'Имя в TG', 'Запрос', 'Найдено', 'ID владельцев'
-            ])
-            search_sheet.format('A1:G1', {
-                'textFormat': {'bold': True},
-                'backgroundColor': {'red': 1.0, 'green': 0.9, 'blue': 0.7}
-            })
-            logger.info(f"📄 Создан лист '{SEARCH_SHEET_NAME}'")
+        reg_sheet = ensure_worksheet(spreadsheet, REG_SHEET_NAME, REG_HEADER,
+                                     {'red': 0.7, 'green': 0.85, 'blue': 1.0})
         
-        logger.info(f"✅ Google Sheets: '{SHEET_NAME}', '{REG_SHEET_NAME}', '{SEARCH_SHEET_NAME}'")
-        return main_sheet, reg_sheet, search_sheet
+        logger.info(f"✅ Google Sheets: '{sheet_name}', '{REG_SHEET_NAME}'")
+        return spreadsheet, main_sheet, reg_sheet
     except Exception as e:
         logger.error(f"❌ Ошибка подключения к Google Sheets: {e}")
         raise
 
-sheet, reg_sheet, search_sheet = init_gsheets()
+GSHEETS = init_gsheets()
 
-# ======== КЭШИ ========
-# Кэш зарегистрированных: telegram_id -> row_number в Лист1
-REGISTERED_TG_TO_ROW = {}
-ROW_TO_REGISTERED_TG = {}
-REGISTERED_TG_IDS = set()  # telegram_id, уже зарегистрированные в боте
 
-# Кэш дедупликации поиска: (tg_id, query_normalized) -> datetime
-SEARCH_DEDUP_CACHE = {}
-DEDUP_WINDOW_SECONDS = 300  # 5 минут
+# ======== ПАРТИЦИИ ЛОГА ПОИСКОВ ========
+# Поиски пишутся в помесячные листы "Поиски 2026-10": живой лист — только
+# текущий месяц, а срок хранения — это удаление целых листов.
+# Старый общий лист "Поиски" (если есть) остаётся доступен для чтения и чистки.
+SEARCH_PARTITION_RE = re.compile(rf'^{re.escape(SEARCH_SHEET_NAME)} (\d{{4}}-\d{{2}})$')
 
 
-def rebuild_registered_cache():
-    """Перестраивает кэш зарегистрированных пользователей"""
-    global REGISTERED_TG_TO_ROW, ROW_TO_REGISTERED_TG, REGISTERED_TG_IDS
-    try:
-        reg_rows = reg_sheet.get_all_values()
-        registered_data = []
-        REGISTERED_TG_IDS = {
-            row[1].strip() for row in reg_rows[1:] if len(row) >= 2 and row[1].strip()
-        }
-        for row in reg_rows[1:]:
-            if len(row) >= 5 and row[1]:
-                registered_data.append({
-                    'tg_id': row[1].strip(),
-                    'fio': row[3].strip(),
-                    'phone': row[4].strip()
-                })
-        
-        main_rows = sheet.get_all_values()
-        REGISTERED_TG_TO_ROW = {}
-        ROW_TO_REGISTERED_TG = {}
-        
-        for idx, row in enumerate(main_rows[1:], start=2):
-            if len(row) < 3:
-                continue
-            row_fio = row[2].strip()
-            row_phone = row[3].strip() if len(row) > 3 else ''
-            
-            for reg in registered_data:
-                phone_digits_main = re.sub(r'\D', '', row_phone)
-                phone_digits_reg = re.sub(r'\D', '', reg['phone'])
-                
-                if phone_digits_main and phone_digits_main == phone_digits_reg:
-                    REGISTERED_TG_TO_ROW[reg['tg_id']] = idx
-                    ROW_TO_REGISTERED_TG[idx] = reg['tg_id']
-                    break
-                elif row_fio and reg['fio'] and row_fio.lower() == reg['fio'].lower():
-                    REGISTERED_TG_TO_ROW[reg['tg_id']] = idx
-                    ROW_TO_REGISTERED_TG[idx] = reg['tg_id']
-                    break
-        
-        logger.info(f"📊 Кэш зарегистрированных: {len(REGISTERED_TG_TO_ROW)} совпадений")
-    except Exception as e:
-        logger.error(f"Ошибка построения кэша: {e}")
+def search_partition_title(moment: datetime.datetime) -> str:
+    return f"{SEARCH_SHEET_NAME} {moment.strftime('%Y-%m')}"
 
 
-# Построить кэш при старте
-rebuild_registered_cache()
+def partition_month(title: str):
+    """'Поиски 2026-10' -> '2026-10', для остальных листов None"""
+    match = SEARCH_PARTITION_RE.match(title)
+    return match.group(1) if match else None
 
 
 # ======== СОСТОЯНИЯ FSM ========
@@ -201,6 +392,19 @@ class UserState(StatesGroup):
     waiting_for_plate = State()
 
 
+@dp.message.outer_middleware()
+async def restore_search_state(handler, event, data):
+    """Зарегистрированный житель без состояния (новое устройство, потерянный
+    файл состояний) сразу попадает в поиск, без повторной регистрации"""
+    state = data.get('state')
+    if (state is not None and data.get('raw_state') is None
+            and event.from_user and registered_lot(event.from_user.id) is not None):
+        await state.set_state(UserState.waiting_for_plate)
+        data['raw_state'] = UserState.waiting_for_plate.state
+        METRICS['fsm_states_restored'] += 1
+    return await handler(event, data)
+
+
 # ======== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ========
 def mask_fio(fio: str) -> str:
     parts = fio.strip().split()
@@ -248,74 +452,269 @@ def is_valid_phone(phone: str) -> bool:
     return False
 
 
-def get_all_users():
-    try:
-        records = sheet.get_all_values()
-        users = []
-        for row in records[1:]:
-            if len(row) >= 3:
-                users.append({
-                    'id': row[0],
-                    'plate': row[1] if len(row) > 1 else '',
-                    'fio': row[2] if len(row) > 2 else '',
-                    'phone': row[3] if len(row) > 3 else '',
-                    'category': row[4] if len(row) > 4 else ''
-                })
-        return users
-    except Exception as e:
-        logger.error(f"Ошибка чтения таблицы: {e}")
-        return []
+# Версия снимка и его данные меняются одним присваиванием
+ResidentData = namedtuple('ResidentData', 'version users index')
+
+
+class ResidentSnapshot:
+    """Снимок листа жильцов в памяти. Перечитывается из Sheets, когда старше
+    RESIDENTS_TTL; version растёт, только если содержимое изменилось.
+
+    mode='write' — после перечитывания снимок пишется в файл (см. snapshot_file.py)
+    вместе с числом зарегистрированных (count_registered) — бот перечитывает его
+    фоновой задачей residents_worker, даже когда поисков нет;
+    mode='read' — снимок берётся из этого файла. Пока файла нет, Sheets читается
+    напрямую, но не чаще раза в RESIDENTS_TTL.
+
+    open_sheet — функция, возвращающая лист жильцов: читатель открывает его,
+    только если файла нет."""
+
+    def __init__(self, open_sheet, ttl: float, mode: str = 'off', path: str = None, name: str = '',
+                 count_registered=None):
+        self.open_sheet = open_sheet
+        self.name = name  # парковка, для логов
+        self.mode = mode
+        self.path = path
+        self.sheets_ttl = ttl
+        self.ttl = RESIDENTS_SNAPSHOT_POLL if mode == 'read' else ttl
+        self.count_registered = count_registered
+        # Зарегистрированных в боте: у читателя — из файла снимка
+        self.registered = 0
+        # Версии продолжают нумерацию из файла, чтобы читатели не видели откат
+        version = read_version(path) if mode == 'write' else 0
+        self.data = ResidentData(version, [], PlateIndex([]))
+        self.loaded_at = None
+        self._sheets_loaded_at = None
+        self._rows = None
+        self._file_id = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self.data.version
+
+    @property
+    def users(self):
+        return self.data.users
+
+    def is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def refresh(self):
+        """Синхронный, вызывать в потоке"""
+        if self.mode == 'read':
+            if self._refresh_from_file() or (
+                    self._sheets_loaded_at is not None
+                    and time.monotonic() - self._sheets_loaded_at < self.sheets_ttl):
+                self.loaded_at = time.monotonic()
+                return
+        records = self.open_sheet().get_all_values()
+        rows = records[1:]
+        changed = rows != self._rows
+        if changed:
+            users = []
+            for row in rows:
+                if len(row) >= 3:
+                    users.append({
+                        'id': row[0],
+                        'plate': row[1] if len(row) > 1 else '',
+                        'fio': row[2] if len(row) > 2 else '',
+                        'phone': row[3] if len(row) > 3 else '',
+                        'category': row[4] if len(row) > 4 else '',
+                        'plates': get_plate_numbers(row[1] if len(row) > 1 else '')
+                    })
+            # ref в индексе — (позиция жильца в users, его номер)
+            index = PlateIndex(((pos, plate), plate)
+                               for pos, user in enumerate(users) for plate in user['plates'])
+            self.data = ResidentData(self.version + 1, users, index)
+            self._rows = rows
+            METRICS['residents_snapshot_reloads'] += 1
+            logger.info(f"📚 Снимок базы жильцов '{self.name}' v{self.version}: {len(users)} записей")
+        if self.mode == 'write':
+            registered = self.count_registered() if self.count_registered else 0
+            # Новое число зарегистрированных пишется в файл без смены версии
+            if changed or registered != self.registered:
+                try:
+                    write_snapshot(self.path, self.version, self.data.users, self.data.index, registered)
+                    self.registered = registered
+                except OSError as e:
+                    logger.error(f"❌ Не удалось записать снимок жильцов {self.path}: {e}")
+        self._sheets_loaded_at = self.loaded_at = time.monotonic()
+
+    def _refresh_from_file(self) -> bool:
+        """Подхватывает новую версию файла; False — файла нет, читаем Sheets сами"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._file_id is not False:
+                logger.warning(f"⚠️ Нет файла снимка {self.path} — читаю Google Sheets напрямую")
+                self._file_id = False
+            return False
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_id != self._file_id:
+            mapped = MappedSnapshot(self.path)
+            if mapped.version != self.version:
+                self.data = ResidentData(mapped.version, mapped.users, mapped.index)
+                METRICS['residents_snapshot_reloads'] += 1
+                logger.info(f"📚 Снимок базы жильцов '{self.name}' v{self.version} из файла: {len(mapped.users)} записей")
+            self.registered = mapped.registered
+            self._file_id = file_id
+        return True
+
+    def get(self, force: bool = False) -> ResidentData:
+        """force — перечитать, даже если снимок свежий (для residents_worker)"""
+        if force or not self.is_fresh():
+            with self._lock:
+                # Пока ждали блокировку, снимок мог обновить другой поток
+                if force or not self.is_fresh():
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logger.error(f"Ошибка чтения таблицы: {e}")
+        return self.data
 
 
 def find_user_by_phone(phone: str):
+    """Ищет телефон в базах жильцов всех парковок: (парковка, житель) или (None, None)"""
     digits = re.sub(r'\D', '', phone)
     if len(digits) == 11 and digits.startswith('8'):
         digits = '7' + digits[1:]
     elif len(digits) == 10:
         digits = '7' + digits
     
-    users = get_all_users()
-    for user in users:
-        user_phones = re.findall(r'\d+', user['phone'])
-        for p in user_phones:
-            p_clean = re.sub(r'\D', '', p)
-            if len(p_clean) == 11 and p_clean.startswith('8'):
-                p_clean = '7' + p_clean[1:]
-            if p_clean == digits:
-                return user
-    return None
-
-
-def find_by_plate_partial(query: str):
+    for lot in LOTS:
+        for user in lot.residents.get().users:
+            user_phones = re.findall(r'\d+', user['phone'])
+            for p in user_phones:
+                p_clean = re.sub(r'\D', '', p)
+                if len(p_clean) == 11 and p_clean.startswith('8'):
+                    p_clean = '7' + p_clean[1:]
+                if p_clean == digits:
+                    return lot, user
+    return None, None
+
+
+def find_by_plate_partial(query: str, data: ResidentData):
     query_norm = normalize_plate(query)
-    users = get_all_users()
-    results = []
-    
-    for user in users:
-        if not user['plate']:
-            continue
-        plate_numbers = get_plate_numbers(user['plate'])
-        for plate_num in plate_numbers:
-            if query_norm in plate_num:
-                results.append({
-                    'id': user['id'],
-                    'plate_raw': user['plate'],
-                    'plate_normalized': plate_num,
-                    'fio': user['fio'],
-                    'phone': user['phone'],
-                    'category': user['category']
-                })
-                break
+    users, index = data.users, data.index
     
     seen = set()
     unique_results = []
-    for r in results:
-        if r['id'] not in seen:
-            seen.add(r['id'])
-            unique_results.append(r)
+    for pos, plate_num in index.substring(query_norm):
+        user = users[pos]
+        if user['id'] in seen:
+            continue
+        seen.add(user['id'])
+        unique_results.append({
+            'id': user['id'],
+            'plate_raw': user['plate'],
+            'plate_normalized': plate_num,
+            'fio': user['fio'],
+            'phone': user['phone'],
+            'category': user['category']
+        })
     return unique_results
 
 
+def find_by_plate_fuzzy(query: str, data: ResidentData):
+    """Похожие номера с учётом частых опечаток (0/О, 8/В, пропущенный символ)"""
+    query_norm = normalize_plate(query)
+    if len(query_norm) < 3:
+        return []
+    users, index = data.users, data.index
+    # В коротком запросе любая правка даёт слишком много совпадений — только похожие символы
+    max_cost = FUZZY_MAX_COST if len(query_norm) >= 4 else min(FUZZY_MAX_COST, 0.9)
+    
+    seen = set()
+    results = []
+    for cost, (pos, plate_num) in index.fuzzy(query_norm, max_cost):
+        user = users[pos]
+        if user['id'] in seen:
+            continue
+        seen.add(user['id'])
+        results.append({
+            'id': user['id'],
+            'plate_raw': user['plate'],
+            'plate_normalized': plate_num,
+            'fio': user['fio'],
+            'phone': user['phone'],
+            'category': user['category']
+        })
+        if len(results) >= FUZZY_MAX_RESULTS:
+            break
+    return results
+
+
+class QueryCache:
+    """LRU: нормализованный запрос -> результаты поиска и отрисованные страницы.
+    Записи привязаны к версии снимка жильцов: новая версия сбрасывает кэш."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, version: int):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            METRICS['query_cache_hits'] += 1
+            return entry
+
+    def put(self, key: str, version: int, results: list, fuzzy: bool = False) -> dict:
+        entry = {
+            'results': results,
+            'fuzzy': fuzzy,  # точных совпадений нет, показаны похожие номера
+            'total_pages': (len(results) + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE,
+            'pages': {}  # номер страницы -> готовый HTML
+        }
+        # Промах считаем здесь: get() вызывается и в event loop, и повторно в потоке
+        METRICS['query_cache_misses'] += 1
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return entry
+
+
+def search_plate_cached(lot, query: str) -> dict:
+    """Поиск через кэш запросов парковки; при устаревшем снимке ходит в Sheets — вызывать в потоке"""
+    data = lot.residents.get()
+    key = normalize_plate(query)
+    version = data.version
+    entry = lot.query_cache.get(key, version)
+    if entry is None:
+        results = find_by_plate_partial(query, data)
+        fuzzy = False
+        if not results and FUZZY_SEARCH:
+            results = find_by_plate_fuzzy(query, data)
+            fuzzy = bool(results)
+            if fuzzy:
+                METRICS['fuzzy_searches_matched'] += 1
+        entry = lot.query_cache.put(key, version, results, fuzzy)
+    return entry
+
+
+async def search_plate(lot, query: str) -> dict:
+    # Свежий снимок и попадание в кэш — без похода в поток
+    if lot.residents.is_fresh():
+        entry = lot.query_cache.get(normalize_plate(query), lot.residents.version)
+        if entry is not None:
+            return entry
+    return await sheets_call(search_plate_cached, lot, query)
+
+
 def format_search_result(user: dict) -> str:
     masked = mask_fio(user['fio'])
     display_plate = get_display_plate(user['plate_raw'])
@@ -349,63 +748,120 @@ def format_search_result(user: dict) -> str:
 
 
 # ======== ЛОГИРОВАНИЕ В GOOGLE SHEETS ========
-def log_registration_to_sheet(user_id: int, username: str, tg_name: str, user_data: dict):
-    try:
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        reg_sheet.append_row([
-            timestamp,
-            str(user_id),
-            f"@{username}" if username else '',
-            user_data.get('fio', ''),
-            user_data.get('phone', ''),
-            tg_name
-        ], value_input_option='USER_ENTERED')
-        logger.info(f"📝 Регистрация записана: {user_id} (@{username})")
-    except Exception as e:
-        logger.error(f"Ошибка записи регистрации: {e}")
-
-
-def log_search_to_sheet(user_id: int, username: str, tg_name: str, query: str, found: int, owner_ids: list):
+def log_registration_to_sheet(lot, user_id: int, username: str, tg_name: str, user_data: dict):
+    """Записывает регистрацию в журнал; в Sheets она уйдёт в фоне (journal_worker)"""
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    row = [
+        timestamp,
+        str(user_id),
+        f"@{username}" if username else '',
+        user_data.get('fio', ''),
+        user_data.get('phone', ''),
+        tg_name
+    ]
+    lot.recent_registrations.add(lot.journal.append(REG_SHEET_NAME, row), row)
+    logger.info("📝 Регистрация записана: %s (@%s)", user_id, username,
+                extra={'event': 'registration', 'tg_id': user_id, 'lot': lot.id})
+
+
+def log_search_to_sheet(lot, user_id: int, username: str, tg_name: str, query: str, found: int, owner_ids: list):
     """
     Сохраняет поисковый запрос с защитой от дублей.
     Возвращает True если записано, False если дубль.
+    Запись идёт в локальный журнал, в Sheets — в фоне.
     """
     query_normalized = re.sub(r'\s+', '', query).upper()
     cache_key = (user_id, query_normalized)
     now = datetime.datetime.now()
     
-    if cache_key in SEARCH_DEDUP_CACHE:
-        last_time = SEARCH_DEDUP_CACHE[cache_key]
+    if cache_key in lot.search_dedup:
+        last_time = lot.search_dedup[cache_key]
         if (now - last_time).total_seconds() < DEDUP_WINDOW_SECONDS:
-            logger.debug(f"⏭️ Дубль поиска пропущен: {cache_key}")
+            logger.debug("⏭️ Дубль поиска пропущен: %s", cache_key)
             return False
     
-    try:
-        timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-        search_sheet.append_row([
-            timestamp,
-            str(user_id),
-            f"@{username}" if username else '',
-            tg_name,
-            query,
-            found,
-            ', '.join(owner_ids) if owner_ids else '-'
-        ], value_input_option='USER_ENTERED')
-        
-        SEARCH_DEDUP_CACHE[cache_key] = now
-        
-        if len(SEARCH_DEDUP_CACHE) > 500:
-            SEARCH_DEDUP_CACHE.clear()
-        
-        logger.info(f"🔍 Поиск записан: '{query}' (found={found})")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка записи поиска: {e}")
-        return False
+    timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+    partition = search_partition_title(now)
+    if lot.recent_searches.title != partition:
+        lot.start_search_partition(partition)
+    row = [
+        timestamp,
+        str(user_id),
+        f"@{username}" if username else '',
+        tg_name,
+        query,
+        found,
+        ', '.join(owner_ids) if owner_ids else '-'
+    ]
+    lot.recent_searches.add(lot.journal.append(partition, row), row)
+    lot.search_stats.record(now.strftime('%Y-%m'), str(user_id), row[2] or tg_name, normalize_plate(query), found)
+    
+    lot.search_dedup[cache_key] = now
+    
+    if len(lot.search_dedup) > 500:
+        lot.search_dedup.clear()
+    
+    logger.info("🔍 Поиск записан: '%s' (found=%s)", query, found,
+                extra={'event': 'search_logged', 'sample': 'search', 'tg_id': user_id, 'query': query,
+                       'found': found, 'lot': lot.id})
+    return True
+
+
+async def journal_worker():
+    """Фоновая отправка журналов всех парковок в Sheets: fsync пачками,
+    append_rows пачками, при ошибках — экспоненциальная пауза для этой
+    парковки. Записи при этом копятся на диске."""
+    failures = {lot.id: 0 for lot in LOTS}
+    last_replay = {lot.id: 0.0 for lot in LOTS}
+    while True:
+        await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+        for lot in LOTS:
+            journal = lot.journal
+            try:
+                await asyncio.to_thread(journal.sync)
+            except Exception as e:
+                logger.error(f"❌ Журнал '{lot.id}': fsync не удался: {e}")
+
+            backoff = JOURNAL_REPLAY_INTERVAL * 2 ** min(failures[lot.id], 6)
+            if not len(journal) or time.monotonic() - last_replay[lot.id] < backoff:
+                continue
+            last_replay[lot.id] = time.monotonic()
+            try:
+                sent = await bulk_sheets_call(journal.replay, lot.log_sheet, JOURNAL_BATCH_SIZE)
+                METRICS['journal_replayed_total'] += sent
+                failures[lot.id] = 0
+                if sent >= JOURNAL_BATCH_SIZE:
+                    last_replay[lot.id] = 0.0  # остались ещё — следующая пачка сразу
+                logger.info(f"📤 Журнал '{lot.id}': отправлено в Sheets {sent}, в очереди {len(journal)}")
+            except Exception as e:
+                failures[lot.id] += 1
+                METRICS['journal_replay_failures'] += 1
+                logger.error(f"❌ Журнал '{lot.id}': Sheets недоступен ({len(journal)} в очереди): {e}")
 
 
-def highlight_registered_owners(rows_to_highlight: set):
+async def fsm_worker():
+    while True:
+        await asyncio.sleep(FSM_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(storage.flush)
+        except Exception as e:
+            logger.error(f"❌ FSM: не удалось сохранить состояния: {e}")
+
+
+async def flush_journal():
+    """Последняя попытка отправить журналы при остановке бота"""
+    for lot in LOTS:
+        try:
+            await asyncio.to_thread(lot.journal.sync)
+            if len(lot.journal):
+                await sheets_call(lot.journal.replay, lot.log_sheet, JOURNAL_BATCH_SIZE)
+        except Exception as e:
+            logger.warning(f"⚠️ Журнал '{lot.id}': при остановке не отправлено {len(lot.journal)} записей: {e}")
+
+
+def highlight_registered_owners(lot, rows_to_highlight: set):
     """Подсвечивает строки зарегистрированных владельцев жёлтым"""
+    sheet = lot.sheet
     try:
         all_values = sheet.get_all_values()
         if len(all_values) > 1:
@@ -425,14 +881,416 @@ def highlight_registered_owners(rows_to_highlight: set):
         logger.error(f"Ошибка подсветки: {e}")
 
 
+async def stats_worker():
+    while True:
+        await asyncio.sleep(STATS_SAVE_INTERVAL)
+        for lot in LOTS:
+            try:
+                await asyncio.to_thread(lot.search_stats.save)
+            except Exception as e:
+                logger.error(f"❌ Не удалось сохранить статистику поисков '{lot.id}': {e}")
+
+
+async def residents_worker():
+    """Раз в RESIDENTS_TTL перечитывает базы жильцов и обновляет файлы снимков —
+    у процессов-читателей свежие данные, даже когда в боте никто не ищет"""
+    while True:
+        for lot in LOTS:
+            await bulk_sheets_call(lot.residents.get, True)
+        await asyncio.sleep(RESIDENTS_TTL)
+
+
+def iter_search_log_rows(lot):
+    """Все строки поисков парковки по одному листу за раз (плюс ещё не отправленные
+    из журнала) как (месяц, telegram_id, имя, номер, найдено) — для SearchStats.rebuild"""
+    titles = [ws.title for ws in lot.spreadsheet.worksheets()
+              if partition_month(ws.title) or ws.title == SEARCH_SHEET_NAME]
+    for title in titles:
+        rows = lot.log_sheet(title, create=False).get_all_values()[1:]
+        rows += [row for _, row in lot.journal.pending_items(title)]
+        for row in rows:
+            if len(row) < 6 or not row[0]:
+                continue
+            found = str(row[5]).strip()
+            yield (partition_month(title) or str(row[0])[:7], str(row[1]).strip(),
+                   row[2] or row[3], normalize_plate(str(row[4])), int(found) if found.isdigit() else 0)
+        del rows
+
+
+# ======== ПОСЛЕДНИЕ ЗАПИСИ (для /registrations и /searches) ========
+class RecentLog:
+    """Хвост листа в памяти и число строк в нём — чтобы показывать последние
+    записи, не скачивая лист целиком.
+
+    Порядок — как в листе: сначала уже отправленные строки, затем ещё лежащие
+    в журнале (журнал отправляется по порядку). Буфер пополняется при записи
+    (add), а страницы старше буфера читаются из листа диапазоном строк.
+    """
+
+    def __init__(self, title: str, width: int, size: int):
+        self.title = title
+        self.width = width  # столбцов данных, без ключа журнала
+        self.items = deque(maxlen=size)  # (ключ журнала или None, строка)
+        self.total = 0
+        self.seeded = False
+        self._lock = threading.Lock()
+        self._seeding = False
+        self._backlog = []
+
+    def add(self, key: str, row: list):
+        with self._lock:
+            self.items.append((key, row))
+            self.total += 1
+            if self._seeding:
+                self._backlog.append((key, row))
+
+    def seed(self, ws, journal: SheetsJournal):
+        """Синхронный: число строк по столбцу A и хвост листа одним диапазоном"""
+        with self._lock:
+            self._seeding = True
+            self._backlog = []
+        try:
+            pending = journal.pending_items(self.title)
+            count = max(len(ws.col_values(1)) - 1, 0)  # без заголовка
+            tail = []
+            if count and self.items.maxlen:
+                first = max(2, count + 2 - self.items.maxlen)
+                tail = ws.get(f"A{first}:{col_letter(self.width + 1)}{count + 1}")
+            in_sheet = {row[self.width] for row in tail if len(row) > self.width}
+            with self._lock:
+                # Строка, записанная между _seeding и pending_items(), есть и там, и там
+                fresh, seen = [], set(in_sheet)
+                for k, r in pending + self._backlog:
+                    if k not in seen:
+                        seen.add(k)
+                        fresh.append((k, r))
+                self.items.clear()
+                self.items.extend((None, row[:self.width]) for row in tail)
+                self.items.extend(fresh)
+                self.total = count + len(fresh)
+                self.seeded = True
+        finally:
+            with self._lock:
+                self._seeding = False
+                self._backlog = []
+
+    def buffered_page(self, page: int, per_page: int):
+        """Строки страницы (1 — самые свежие) от новых к старым,
+        или None, если страница не целиком в буфере."""
+        if not self.seeded:
+            return None
+        with self._lock:
+            end = self.total - (page - 1) * per_page
+            start = max(0, end - per_page)
+            offset = self.total - len(self.items)
+            if end <= 0:
+                return []
+            if start < offset:
+                return None
+            rows = [row for _, row in list(self.items)[start - offset:end - offset]]
+        return list(reversed(rows))
+
+    def read_page(self, ws, journal: SheetsJournal, page: int, per_page: int) -> list:
+        """Синхронный: страница старше буфера — диапазоном строк из листа"""
+        if not self.seeded:
+            self.seed(ws, journal)
+            rows = self.buffered_page(page, per_page)
+            if rows is not None:
+                return rows
+        end = self.total - (page - 1) * per_page
+        start = max(0, end - per_page)
+        if end <= 0:
+            return []
+        METRICS['recent_log_range_reads'] += 1
+        rows = ws.get(f"A{start + 2}:{col_letter(self.width)}{end + 1}")
+        return list(reversed(rows))
+
+
+# ======== ПАРКОВКИ ========
+# Окно дедупликации поиска (кэш дублей у каждой парковки свой)
+DEDUP_WINDOW_SECONDS = 300  # 5 минут
+
+
+class Lot:
+    """Одна парковка — своя таблица: листы, журнал записей, статистика,
+    снимок жильцов и кэши. Клиент Google Sheets, пул потоков, фоновые задачи
+    и HTTP-сервер общие на все парковки процесса."""
+
+    def __init__(self, config: dict):
+        self.id = config['id']
+        self.title = config['title']
+        self.config = config
+        # Процесс-читатель снимка (web_server.py): только поиск по файлу
+        self.readonly = RESIDENTS_SNAPSHOT_MODE == 'read'
+        self.spreadsheet = self.sheet = self.reg_sheet = None
+        self.journal = self.search_stats = None
+        self.residents = ResidentSnapshot(self.main_sheet, RESIDENTS_TTL, RESIDENTS_SNAPSHOT_MODE,
+                                          config['snapshot_file'], self.id,
+                                          count_registered=lambda: len(self.registered_tg_ids))
+        self.query_cache = QueryCache(QUERY_CACHE_SIZE)
+
+        # Кэш зарегистрированных: telegram_id -> row_number в листе жильцов
+        self.registered_tg_to_row = {}
+        self.row_to_registered_tg = {}
+        self.registered_tg_ids = set()  # telegram_id, уже зарегистрированные в боте
+        # Кэш дедупликации поиска: (tg_id, query_normalized) -> datetime
+        self.search_dedup = {}
+        self.recent_registrations = self.recent_searches = None
+        self.archive_logs = {}
+        if self.readonly:
+            # Ни листов логов, ни журнала, ни кэша регистраций: всё это ведёт
+            # процесс бота, а число зарегистрированных читатель берёт из файла снимка
+            return
+
+        self.spreadsheet, self.sheet, self.reg_sheet = open_lot_sheets(
+            GSHEETS, config['spreadsheet_id'], config['sheet_name'])
+        self._log_sheets = {REG_SHEET_NAME: self.reg_sheet}
+        self._log_sheets_lock = threading.Lock()
+        self.log_sheet(search_partition_title(datetime.datetime.now()))
+
+        # Все записи в Sheets идут через локальный журнал (см. journal.py)
+        self.journal = SheetsJournal(os.path.join(config['data_dir'], 'sheets-journal.log'))
+        # Счётчики для /stats, обновляются при каждой записи поиска (см. search_stats.py)
+        self.search_stats = SearchStats(os.path.join(config['data_dir'], 'search-stats.json'))
+        self.rebuild_registered_cache()
+
+        self.recent_registrations = RecentLog(REG_SHEET_NAME, len(REG_HEADER), RECENT_BUFFER_SIZE)
+        # Только текущий месячный лист поисков; меняется при смене месяца
+        self.recent_searches = RecentLog(search_partition_title(datetime.datetime.now()),
+                                         len(SEARCH_HEADER), RECENT_BUFFER_SIZE)
+        # Прошлые месяцы и старый лист (archive_logs): без буфера, только счётчик строк и чтение диапазонами
+        for recent in (self.recent_registrations, self.recent_searches):
+            try:
+                recent.seed(self.log_sheet(recent.title), self.journal)
+            except Exception as e:
+                logger.error(f"Ошибка чтения хвоста листа '{recent.title}' ({self.id}): {e}")
+
+    @property
+    def registered_count(self) -> int:
+        return self.residents.registered if self.readonly else len(self.registered_tg_ids)
+
+    def main_sheet(self):
+        """Лист жильцов; читатель открывает его, только если нет файла снимка"""
+        if self.sheet is None:
+            self.sheet = GSHEETS.open_by_key(self.config['spreadsheet_id']).worksheet(self.config['sheet_name'])
+        return self.sheet
+
+    def log_sheet(self, title: str, create: bool = True):
+        """Лист лога по имени (с кэшем). Помесячные листы поисков создаются при первой записи."""
+        with self._log_sheets_lock:
+            ws = self._log_sheets.get(title)
+        if ws is None:
+            if create:
+                ws = ensure_worksheet(self.spreadsheet, title, SEARCH_HEADER,
+                                      {'red': 1.0, 'green': 0.9, 'blue': 0.7})
+            else:
+                ws = self.spreadsheet.worksheet(title)
+            with self._log_sheets_lock:
+                self._log_sheets[title] = ws
+        return ws
+
+    def forget_log_sheet(self, title: str):
+        with self._log_sheets_lock:
+            self._log_sheets.pop(title, None)
+
+    def rebuild_registered_cache(self):
+        """Перестраивает кэш зарегистрированных пользователей"""
+        try:
+            # Регистрации, ещё не отправленные из журнала, тоже считаются
+            pending = self.journal.pending_rows(REG_SHEET_NAME)
+            reg_rows = self.reg_sheet.get_all_values() + pending
+            registered_data = []
+            registered_tg_ids = {
+                row[1].strip() for row in reg_rows[1:] if len(row) >= 2 and row[1].strip()
+            }
+            for row in reg_rows[1:]:
+                if len(row) >= 5 and row[1]:
+                    registered_data.append({
+                        'tg_id': row[1].strip(),
+                        'fio': row[3].strip(),
+                        'phone': row[4].strip()
+                    })
+            
+            main_rows = self.sheet.get_all_values()
+            tg_to_row = {}
+            row_to_tg = {}
+            
+            for idx, row in enumerate(main_rows[1:], start=2):
+                if len(row) < 3:
+                    continue
+                row_fio = row[2].strip()
+                row_phone = row[3].strip() if len(row) > 3 else ''
+                
+                for reg in registered_data:
+                    phone_digits_main = re.sub(r'\D', '', row_phone)
+                    phone_digits_reg = re.sub(r'\D', '', reg['phone'])
+                    
+                    if phone_digits_main and phone_digits_main == phone_digits_reg:
+                        tg_to_row[reg['tg_id']] = idx
+                        row_to_tg[idx] = reg['tg_id']
+                        break
+                    elif row_fio and reg['fio'] and row_fio.lower() == reg['fio'].lower():
+                        tg_to_row[reg['tg_id']] = idx
+                        row_to_tg[idx] = reg['tg_id']
+                        break
+            
+            self.registered_tg_ids = registered_tg_ids
+            self.registered_tg_to_row = tg_to_row
+            self.row_to_registered_tg = row_to_tg
+            logger.info(f"📊 Кэш зарегистрированных '{self.id}': {len(tg_to_row)} совпадений")
+        except Exception as e:
+            logger.error(f"Ошибка построения кэша '{self.id}': {e}")
+
+    def start_search_partition(self, title: str):
+        """Новый месяц — новый пустой лист поисков и новый буфер"""
+        recent = RecentLog(title, len(SEARCH_HEADER), RECENT_BUFFER_SIZE)
+        recent.seeded = True
+        self.recent_searches = recent
+        logger.info(f"🗓️ Поиски '{self.id}' теперь пишутся в лист '{title}'")
+
+    def search_log(self, title: str) -> RecentLog:
+        if title == self.recent_searches.title:
+            return self.recent_searches
+        if title not in self.archive_logs:
+            self.archive_logs[title] = RecentLog(title, len(SEARCH_HEADER), 0)
+        return self.archive_logs[title]
+
+
+LOTS = [Lot(config) for config in LOT_CONFIGS]
+LOTS_BY_ID = {lot.id: lot for lot in LOTS}
+# Админ -> парковка, выбранная командой /lot
+ADMIN_LOTS = {}
+
+
+def registered_lot(user_id: int):
+    """Парковка, в листе 'Регистрации' которой есть житель, или None"""
+    tg_id = str(user_id)
+    for lot in LOTS:
+        if tg_id in lot.registered_tg_ids:
+            return lot
+    return None
+
+
+def lot_for_user(user_id: int):
+    """С какой парковкой работает пользователь: админ — с выбранной через /lot,
+    житель — со своей. None — житель не зарегистрирован ни на одной из нескольких."""
+    lot = ADMIN_LOTS.get(user_id) or registered_lot(user_id)
+    if lot is None and (len(LOTS) == 1 or is_admin(user_id)):
+        lot = LOTS[0]
+    return lot
+
+
+def lot_header(lot) -> str:
+    """Название парковки над ответом админу — только если парковок несколько"""
+    return f"🅿️ <b>{html_mod.escape(lot.title)}</b>\n" if len(LOTS) > 1 else ''
+
+
 # ======== УВЕДОМЛЕНИЯ АДМИНАМ ========
-async def notify_admins_new_registration(user_id: int, username: str, tg_name: str, user_data: dict):
-    """Уведомляет всех админов о новой регистрации"""
+class NotificationDispatcher:
+    """Исходящие уведомления: отправка в фоне, не в обработчике апдейта.
+
+    Каждый чат обслуживает своя задача: первое сообщение уходит сразу, а всё,
+    что пришло за следующие chat_interval сек, объединяется в одну сводку.
+    Общий темп отправки — не больше rate сообщений в секунду на весь бот.
+    На TelegramRetryAfter отправка приостанавливается на указанное время
+    и повторяется.
+    """
+
+    MAX_LENGTH = 4096
+
+    def __init__(self, rate: float, chat_interval: float):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self._pending = {}  # chat_id -> [текст, ...]
+        self._tasks = {}    # chat_id -> задача отправки
+        self._next_send = 0.0
+        self._lock = asyncio.Lock()
+        self._flushing = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(texts) for texts in self._pending.values())
+
+    def notify(self, chat_id: int, text: str):
+        self._pending.setdefault(chat_id, []).append(text)
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    async def _acquire(self):
+        """Общий темп: не чаще rate сообщений в секунду"""
+        async with self._lock:
+            delay = self._next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_send = max(self._next_send, time.monotonic()) + 1 / self.rate
+
+    def _digest(self, texts: list) -> list:
+        if len(texts) == 1:
+            return texts
+        METRICS['notifications_digests'] += 1
+        messages, current = [], f"🗞 <b>Сводка: {len(texts)} уведомлений</b>"
+        for text in texts:
+            part = f"\n\n{'─' * 20}\n{text}"
+            if len(current) + len(part) > self.MAX_LENGTH:
+                messages.append(current)
+                current = text
+            else:
+                current += part
+        messages.append(current)
+        return messages
+
+    async def _send(self, chat_id: int, text: str):
+        while True:
+            await self._acquire()
+            try:
+                await bot.send_message(chat_id, text, parse_mode="HTML")
+                METRICS['notifications_sent'] += 1
+                return
+            except TelegramRetryAfter as e:
+                METRICS['notifications_retry_after'] += 1
+                logger.warning(f"⏳ Telegram просит подождать {e.retry_after} сек (чат {chat_id})")
+                async with self._lock:
+                    self._next_send = max(self._next_send, time.monotonic() + e.retry_after)
+            except Exception as e:
+                METRICS['notifications_failed'] += 1
+                logger.error(f"Не удалось отправить уведомление в {chat_id}: {e}")
+                return
+
+    async def _drain(self, chat_id: int):
+        try:
+            while self._pending.get(chat_id):
+                texts = self._pending.pop(chat_id)
+                for text in self._digest(texts):
+                    await self._send(chat_id, text)
+                # Пока ждём, новые уведомления копятся в сводку
+                try:
+                    await asyncio.wait_for(self._flushing.wait(), self.chat_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._tasks.pop(chat_id, None)
+
+    async def flush(self, timeout: float):
+        """При остановке: отправить накопленное, не дожидаясь пауз между сводками"""
+        self._flushing.set()
+        if not self._tasks:
+            return
+        _, unfinished = await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+        if unfinished:
+            logger.warning(f"⚠️ Не отправлено уведомлений при остановке: {self.pending}")
+
+
+NOTIFIER = NotificationDispatcher(NOTIFY_RATE, NOTIFY_CHAT_INTERVAL)
+
+
+async def notify_admins_new_registration(lot, user_id: int, username: str, tg_name: str, user_data: dict):
+    """Уведомляет всех админов о новой регистрации (отправка в фоне)"""
     if not ADMIN_IDS:
         return
     
     text = (
         f"🆕 <b>Новая регистрация!</b>\n\n"
+        f"{lot_header(lot)}"
         f"👤 <b>ФИО:</b> {user_data.get('fio', '—')}\n"
         f"📞 <b>Телефон:</b> {user_data.get('phone', '—')}\n"
         f"📂 <b>Категория:</b> {user_data.get('category', '—')}\n"
@@ -443,10 +1301,98 @@ async def notify_admins_new_registration(user_id: int, username: str, tg_name: s
     )
     
     for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text, parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Не удалось уведомить админа {admin_id}: {e}")
+        NOTIFIER.notify(admin_id, text)
+
+
+# ======== АНТИФЛУД ========
+def parse_rate(value: str) -> tuple:
+    """'8/20' -> (8, 20.0): запас запросов и пополнение в минуту"""
+    burst, _, per_minute = value.partition('/')
+    burst, per_minute = int(burst), float(per_minute or burst)
+    # Без пополнения задержка (1 - токены) / rate делилась бы на ноль
+    if burst < 1 or not per_minute > 0:
+        raise ValueError(f"Лимит '{value}': запас и пополнение в минуту должны быть больше нуля")
+    return burst, per_minute
+
+
+class TokenBucketLimiter:
+    """Token bucket на каждую пару (класс запроса, Telegram ID).
+
+    Хранится не больше max_keys корзин: самые давно не использованные
+    вытесняются (для них это равносильно полной корзине).
+    """
+
+    def __init__(self, rules: dict, max_keys: int, max_delay: float):
+        self.rules = rules
+        self.max_keys = max_keys
+        self.max_delay = max_delay
+        self._buckets = OrderedDict()  # (класс, tg_id) -> [токены, время, предупреждён]
+
+    def acquire(self, kind: str, user_id: int):
+        """Списывает токен. Возвращает задержку в секундах (0 — сразу),
+        или None, если ждать пришлось бы дольше max_delay."""
+        burst, per_minute = self.rules[kind]
+        rate = per_minute / 60
+        now = time.monotonic()
+        key = (kind, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now, False]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        delay = 0.0 if bucket[0] >= 1 else (1 - bucket[0]) / rate
+        if delay > self.max_delay:
+            return None
+        bucket[0] -= 1
+        bucket[2] = False
+        return delay
+
+    def first_rejection(self, kind: str, user_id: int) -> bool:
+        """True только для первого отказа подряд — чтобы не отвечать на каждый"""
+        bucket = self._buckets.get((kind, user_id))
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        return True
+
+
+THROTTLER = TokenBucketLimiter({
+    'search': parse_rate(THROTTLE_SEARCH),
+    'pagination': parse_rate(THROTTLE_PAGINATION),
+    'registration': parse_rate(THROTTLE_REGISTRATION),
+}, max_keys=THROTTLE_MAX_USERS, max_delay=THROTTLE_MAX_DELAY)
+
+
+async def throttle_middleware(handler, event, data):
+    """Отсекает лишние запросы до хендлера. Класс задаётся флагом хендлера 'throttle'."""
+    kind = get_flag(data, 'throttle')
+    user = data.get('event_from_user')
+    if not kind or user is None or is_admin(user.id):
+        return await handler(event, data)
+
+    delay = THROTTLER.acquire(kind, user.id)
+    if delay is None:
+        METRICS[f'throttled_{kind}'] += 1
+        text = "⏳ Слишком много запросов. Подождите немного и повторите."
+        warn = THROTTLER.first_rejection(kind, user.id)
+        if isinstance(event, CallbackQuery):
+            await event.answer(text if warn else None, show_alert=warn)
+        elif warn:
+            await event.answer(text)
+        return None
+    if delay:
+        METRICS[f'delayed_{kind}'] += 1
+        await UPDATE_GATE.sleep(delay)
+    return await handler(event, data)
+
+
+dp.message.middleware(throttle_middleware)
+dp.callback_query.middleware(throttle_middleware)
 
 
 # ======== КОМАНДЫ БОТА ========
@@ -479,22 +1425,22 @@ async def registration_button(message: Message, state: FSMContext):
     )
 
 
-@dp.message(F.contact)
+@dp.message(F.contact, flags={'throttle': 'registration'})
 async def process_contact(message: Message, state: FSMContext):
     phone = message.contact.phone_number
-    user = await sheets_call(find_user_by_phone, phone)
+    lot, user = await sheets_call(find_user_by_phone, phone)
     if user:
-        await state.update_data(phone=phone, user_id=user['id'], fio=user['fio'])
+        await state.update_data(phone=phone, user_id=user['id'], fio=user['fio'], lot=lot.id)
         
         tg_name = message.from_user.first_name or ''
         tg_username = message.from_user.username or ''
         
-        already_registered = str(message.from_user.id) in REGISTERED_TG_IDS
+        already_registered = str(message.from_user.id) in lot.registered_tg_ids
         
         if not already_registered:
-            # Записываем регистрацию
-            await sheets_call(
-                log_registration_to_sheet,
+            # Записываем регистрацию в таблицу парковки, где нашёлся телефон
+            log_registration_to_sheet(
+                lot,
                 user_id=message.from_user.id,
                 username=tg_username,
                 tg_name=tg_name,
@@ -502,17 +1448,19 @@ async def process_contact(message: Message, state: FSMContext):
             )
             
             # Обновляем кэш
-            await sheets_call(rebuild_registered_cache)
+            await bulk_sheets_call(lot.rebuild_registered_cache)
             
             # Уведомляем админов
             await notify_admins_new_registration(
+                lot,
                 user_id=message.from_user.id,
                 username=tg_username,
                 tg_name=tg_name,
                 user_data=user
             )
         else:
-            logger.info(f"⏭️ Повторная регистрация без записи: {message.from_user.id}")
+            logger.info("⏭️ Повторная регистрация без записи: %s", message.from_user.id,
+                        extra={'event': 'registration_repeat', 'tg_id': message.from_user.id})
         
         await message.answer(
             f"✅ Регистрация успешна!\n\n"
@@ -535,28 +1483,29 @@ async def process_contact(message: Message, state: FSMContext):
         await state.clear()
 
 
-@dp.message(UserState.waiting_for_phone, F.text)
+@dp.message(UserState.waiting_for_phone, F.text, flags={'throttle': 'registration'})
 async def phone_text_fallback(message: Message, state: FSMContext):
     if is_valid_phone(message.text):
-        user = await sheets_call(find_user_by_phone, message.text)
+        lot, user = await sheets_call(find_user_by_phone, message.text)
         if user:
-            await state.update_data(phone=message.text, user_id=user['id'], fio=user['fio'])
+            await state.update_data(phone=message.text, user_id=user['id'], fio=user['fio'], lot=lot.id)
             
             tg_name = message.from_user.first_name or ''
             tg_username = message.from_user.username or ''
             
-            already_registered = str(message.from_user.id) in REGISTERED_TG_IDS
+            already_registered = str(message.from_user.id) in lot.registered_tg_ids
             
             if not already_registered:
-                await sheets_call(
-                    log_registration_to_sheet,
+                log_registration_to_sheet(
+                    lot,
                     user_id=message.from_user.id,
                     username=tg_username,
                     tg_name=tg_name,
                     user_data=user
                 )
-                await sheets_call(rebuild_registered_cache)
+                await bulk_sheets_call(lot.rebuild_registered_cache)
                 await notify_admins_new_registration(
+                    lot,
                     user_id=message.from_user.id,
                     username=tg_username,
                     tg_name=tg_name,
@@ -584,7 +1533,7 @@ search_cache = {}
 SEARCH_CACHE_LIMIT = 100
 
 
-@dp.message(UserState.waiting_for_plate, F.text)
+@dp.message(UserState.waiting_for_plate, F.text, flags={'throttle': 'search'})
 async def process_plate(message: Message, state: FSMContext):
     plate_input = message.text.strip()
     
@@ -592,7 +1541,8 @@ async def process_plate(message: Message, state: FSMContext):
     username = message.from_user.username or ''
     tg_name = message.from_user.first_name or ''
     
-    logger.info(f"🔍 ПОИСК: '{username}' (id:{user_id}) → '{plate_input}'")
+    logger.info("🔍 ПОИСК: '%s' (id:%s) → '%s'", username, user_id, plate_input,
+                extra={'event': 'search', 'sample': 'search', 'tg_id': user_id, 'query': plate_input})
     
     if not plate_input:
         await message.answer("⚠️ Пожалуйста, введите номер автомобиля.")
@@ -602,11 +1552,19 @@ async def process_plate(message: Message, state: FSMContext):
         await message.answer("⚠️ Номер содержит недопустимые символы. Используйте буквы и цифры.")
         return
     
-    results = await sheets_call(find_by_plate_partial, plate_input)
+    lot = lot_for_user(user_id)
+    if lot is None:
+        await message.answer("⚠️ Сначала зарегистрируйтесь: /start")
+        return
+    
+    entry = await search_plate(lot, plate_input)
+    results = entry['results']
     
-    # Записываем в Google Sheets (с защитой от дублей)
-    owner_ids = [r['id'] for r in results]
-    await sheets_call(log_search_to_sheet, user_id, username, tg_name, plate_input, len(results), owner_ids)
+    # Записываем в Google Sheets (с защитой от дублей). Похожие номера —
+    # только подсказка: в журнал и статистику такой поиск идёт как промах
+    exact = [] if entry['fuzzy'] else results
+    owner_ids = [r['id'] for r in exact]
+    log_search_to_sheet(lot, user_id, username, tg_name, plate_input, len(exact), owner_ids)
     
     if not results:
         await message.answer(
@@ -617,11 +1575,8 @@ async def process_plate(message: Message, state: FSMContext):
         return
     
     chat_id = message.chat.id
-    search_cache[chat_id] = {
-        'results': results,
-        'page': 0,
-        'total_pages': (len(results) + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
-    }
+    # Запись кэша запросов общая: страницы, отрисованные для одного жителя, переиспользуются
+    search_cache[chat_id] = entry
     while len(search_cache) > SEARCH_CACHE_LIMIT:
         search_cache.pop(next(iter(search_cache)))
     
@@ -634,20 +1589,26 @@ async def send_search_results(message: Message, chat_id: int, page: int):
         await message.answer("❌ Результаты поиска устарели. Пожалуйста, выполните поиск заново.")
         return
     
-    results = cache['results']
     total_pages = cache['total_pages']
-    start_idx = page * RESULTS_PER_PAGE
-    end_idx = min(start_idx + RESULTS_PER_PAGE, len(results))
-    page_results = results[start_idx:end_idx]
-    
-    response_parts = [f"🔍 <b>Найдено автомобилей: {len(results)}</b>\n"]
-    
-    for i, result in enumerate(page_results, start=start_idx + 1):
-        formatted = format_search_result(result)
-        response_parts.append(f"{i}. {formatted}")
-        response_parts.append("─" * 30)
-    
-    response_text = "\n".join(response_parts)
+    response_text = cache['pages'].get(page)
+    if response_text is None:
+        results = cache['results']
+        start_idx = page * RESULTS_PER_PAGE
+        end_idx = min(start_idx + RESULTS_PER_PAGE, len(results))
+        page_results = results[start_idx:end_idx]
+        
+        if cache['fuzzy']:
+            response_parts = [f"🤔 <b>Точных совпадений нет. Похожие номера: {len(results)}</b>\n"]
+        else:
+            response_parts = [f"🔍 <b>Найдено автомобилей: {len(results)}</b>\n"]
+        
+        for i, result in enumerate(page_results, start=start_idx + 1):
+            formatted = format_search_result(result)
+            response_parts.append(f"{i}. {formatted}")
+            response_parts.append("─" * 30)
+        
+        response_text = "\n".join(response_parts)
+        cache['pages'][page] = response_text
     
     inline_keyboard = []
     nav_buttons = []
@@ -666,7 +1627,7 @@ async def send_search_results(message: Message, chat_id: int, page: int):
     await message.answer(response_text, parse_mode="HTML", reply_markup=reply_markup)
 
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("search_page_"))
+@dp.callback_query(lambda c: c.data and c.data.startswith("search_page_"), flags={'throttle': 'pagination'})
 async def handle_search_page(callback: CallbackQuery):
     page = int(callback.data.split("_")[-1])
     chat_id = callback.message.chat.id
@@ -691,29 +1652,143 @@ async def handle_new_search(callback: CallbackQuery, state: FSMContext):
     await callback.message.delete()
 
 
+# ======== INLINE-РЕЖИМ ========
+# telegram_id -> id последнего inline-запроса (для дебаунса)
+_inline_latest = {}
+
+
+def build_inline_results(entry: dict) -> list:
+    """Карточки для inline-ответа; один раз на запись кэша запросов"""
+    if 'inline' not in entry:
+        entry['inline'] = [
+            InlineQueryResultArticle(
+                id=f"{r['id']}-{i}",
+                title=f"🚗 {get_display_plate(r['plate_raw'])}",
+                description=" · ".join(filter(None, [mask_fio(r['fio']), r['category']])),
+                input_message_content=InputTextMessageContent(
+                    message_text=format_search_result(r),
+                    parse_mode="HTML"
+                )
+            )
+            for i, r in enumerate(entry['results'][:INLINE_MAX_RESULTS])
+        ]
+    return entry['inline']
+
+
+@dp.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """@bot А12 в любом чате — подсказки по части номера (только для зарегистрированных)"""
+    user_id = inline_query.from_user.id
+    METRICS['inline_queries_total'] += 1
+    
+    if registered_lot(user_id) is None and not is_admin(user_id):
+        await inline_query.answer(
+            [], cache_time=INLINE_CACHE_TIME, is_personal=True,
+            button=InlineQueryResultsButton(text="📱 Зарегистрируйтесь в боте", start_parameter="inline")
+        )
+        return
+    
+    query = re.sub(r'[^А-Яа-яA-Za-z0-9]', '', inline_query.query)
+    if len(query) < 2:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+    
+    # Запросы приходят на каждое нажатие клавиши: отвечаем только на последний
+    # (пока ждём, слот обработки свободен для других апдейтов)
+    _inline_latest[user_id] = inline_query.id
+    await UPDATE_GATE.sleep(INLINE_DEBOUNCE)
+    if _inline_latest.get(user_id) != inline_query.id:
+        METRICS['inline_queries_debounced'] += 1
+        return
+    del _inline_latest[user_id]
+    
+    entry = await search_plate(lot_for_user(user_id), query)
+    await inline_query.answer(
+        build_inline_results(entry), cache_time=INLINE_CACHE_TIME, is_personal=True
+    )
+
+
 # ======== АДМИНСКИЕ КОМАНДЫ ========
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
+ADMIN_PAGE_SIZE = 20
+
+
+def parse_page_arg(message: Message) -> int:
+    """Номер страницы из '/searches 3' (1 — самые свежие)"""
+    args = (message.text or '').split()
+    return max(1, int(args[1])) if len(args) > 1 and args[1].isdigit() else 1
+
+
+async def get_recent_page(lot, recent: RecentLog, page: int) -> list:
+    rows = recent.buffered_page(page, ADMIN_PAGE_SIZE)
+    if rows is None:
+        def read():
+            ws = lot.log_sheet(recent.title, create=False)
+            return recent.read_page(ws, lot.journal, page, ADMIN_PAGE_SIZE)
+        rows = await bulk_sheets_call(read)
+    return rows
+
+
+def page_footer(command: str, page: int, total: int) -> str:
+    total_pages = max(1, (total + ADMIN_PAGE_SIZE - 1) // ADMIN_PAGE_SIZE)
+    footer = f"\n<i>Страница {page} из {total_pages}"
+    if page < total_pages:
+        footer += f". Старше: /{command} {page + 1}"
+    return footer + "</i>"
+
+
+@dp.message(Command("lot"))
+async def cmd_lot(message: Message):
+    """Список парковок; /lot north — админские команды работают с этой парковкой"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ Только для админов.")
+        return
+    
+    args = message.text.split()
+    if len(args) > 1:
+        lot = LOTS_BY_ID.get(args[1])
+        if lot is None:
+            await message.answer(f"⚠️ Нет парковки '{html_mod.escape(args[1])}'. Список: /lot", parse_mode="HTML")
+            return
+        ADMIN_LOTS[message.from_user.id] = lot
+        await message.answer(f"✅ Админские команды теперь для парковки <b>{html_mod.escape(lot.title or lot.id)}</b>.",
+                             parse_mode="HTML")
+        return
+    
+    current = lot_for_user(message.from_user.id)
+    lines = [f"🅿️ <b>Парковок: {len(LOTS)}</b>\n"]
+    for lot in LOTS:
+        mark = "👉 " if lot is current else "• "
+        lines.append(
+            f"{mark}<code>{lot.id}</code> {html_mod.escape(lot.title)} — "
+            f"жильцов: {len(lot.residents.users)}, в боте: {len(lot.registered_tg_ids)}"
+        )
+    if len(LOTS) > 1:
+        lines.append("\n<i>Выбрать: /lot id</i>")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
 @dp.message(Command("registrations"))
 async def cmd_registrations(message: Message):
-    """Показывает последние регистрации"""
+    """Показывает последние регистрации. /registrations 2 — следующие 20 и т.д."""
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Эта команда только для админов.")
         return
     
+    lot = lot_for_user(message.from_user.id)
+    page = parse_page_arg(message)
     try:
-        rows = await sheets_call(reg_sheet.get_all_values)
-        if len(rows) <= 1:
+        recent = await get_recent_page(lot, lot.recent_registrations, page)
+        total = lot.recent_registrations.total
+        if not total:
             await message.answer("📭 Пока никто не зарегистрировался.")
             return
         
-        total = len(rows) - 1
-        recent = list(reversed(rows[1:]))[:20]
-        
-        response_parts = [f"📋 <b>Регистраций всего: {total}</b>\n"]
-        response_parts.append("<b>Последние 20:</b>\n")
+        response_parts = [f"{lot_header(lot)}📋 <b>Регистраций всего: {total}</b>\n"]
+        response_parts.append(f"<b>Последние {ADMIN_PAGE_SIZE}:</b>\n" if page == 1 else f"<b>Страница {page}:</b>\n")
         
         for row in recent:
             if len(row) >= 6:
@@ -727,30 +1802,49 @@ async def cmd_registrations(message: Message):
         text = "\n".join(response_parts)
         if len(text) > 4000:
             text = text[:4000] + "\n\n<i>... (показаны первые 4000 символов)</i>"
+        text += page_footer("registrations", page, total)
         
         await message.answer(text, parse_mode="HTML")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
 
+def parse_searches_args(message: Message, lot) -> tuple:
+    """'/searches [ГГГГ-ММ | old] [стр]' -> (имя листа, страница)"""
+    title, page = lot.recent_searches.title, 1
+    for arg in (message.text or '').split()[1:]:
+        if arg.isdigit():
+            page = max(1, int(arg))
+        elif re.fullmatch(r'\d{4}-\d{2}', arg):
+            title = f"{SEARCH_SHEET_NAME} {arg}"
+        elif arg.lower() == 'old':
+            title = SEARCH_SHEET_NAME
+    return title, page
+
+
 @dp.message(Command("searches"))
 async def cmd_searches(message: Message):
-    """Показывает последние поисковые запросы"""
+    """Показывает последние поисковые запросы текущего месяца.
+    /searches 2 — следующие 20, /searches 2026-09 — за прошлый месяц, /searches old — старый лист."""
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Эта команда только для админов.")
         return
     
+    lot = lot_for_user(message.from_user.id)
+    title, page = parse_searches_args(message, lot)
+    month = partition_month(title)
+    label = f"за {month}" if month else "в старом листе"
+    command = "searches" if title == lot.recent_searches.title else f"searches {month or 'old'}"
     try:
-        rows = await sheets_call(search_sheet.get_all_values)
-        if len(rows) <= 1:
-            await message.answer("📭 Поисков ещё не было.")
+        log = lot.search_log(title)
+        recent = await get_recent_page(lot, log, page)
+        total = log.total
+        if not total:
+            await message.answer(f"📭 Поисков {label} нет.")
             return
         
-        total = len(rows) - 1
-        recent = list(reversed(rows[1:]))[:20]
-        
-        response_parts = [f"🔍 <b>Поисков всего: {total}</b>\n"]
-        response_parts.append("<b>Последние 20:</b>\n")
+        response_parts = [f"{lot_header(lot)}🔍 <b>Поисков {label}: {total}</b>\n"]
+        response_parts.append(f"<b>Последние {ADMIN_PAGE_SIZE}:</b>\n" if page == 1 else f"<b>Страница {page}:</b>\n")
         
         for row in recent:
             if len(row) >= 7:
@@ -763,22 +1857,107 @@ async def cmd_searches(message: Message):
         text = "\n".join(response_parts)
         if len(text) > 4000:
             text = text[:4000] + "\n\n<i>... (показаны первые 4000 символов)</i>"
+        text += page_footer(command, page, total)
         
         await message.answer(text, parse_mode="HTML")
+    except gspread.WorksheetNotFound:
+        lot.archive_logs.pop(title, None)
+        await message.answer(f"📭 Листа '{title}' нет. Список: /search_partitions")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {e}")
+
+
+@dp.message(Command("search_partitions"))
+async def cmd_search_partitions(message: Message):
+    """Список помесячных листов поисков"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ Только для админов.")
+        return
+    lot = lot_for_user(message.from_user.id)
+    try:
+        worksheets = await bulk_sheets_call(lot.spreadsheet.worksheets)
+        months = sorted(filter(None, (partition_month(ws.title) for ws in worksheets)), reverse=True)
+        lines = [f"{lot_header(lot)}🗓️ <b>Листы поисков:</b> {len(months)}\n"]
+        lines += [f"• <code>{m}</code> — /searches {m}" for m in months]
+        if any(ws.title == SEARCH_SHEET_NAME for ws in worksheets):
+            lines.append(f"• старый лист '{SEARCH_SHEET_NAME}' — /searches old")
+        await message.answer("\n".join(lines), parse_mode="HTML")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Статистика поисков: /stats — текущий месяц, /stats 2026-09, /stats all,
+    /stats rebuild — пересчитать по листам"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ Только для админов.")
+        return
+    
+    lot = lot_for_user(message.from_user.id)
+    stats = lot.search_stats
+    args = message.text.split()
+    arg = args[1].lower() if len(args) > 1 else datetime.datetime.now().strftime('%Y-%m')
+    
+    if arg == 'rebuild':
+        await message.answer("📊 Пересчитываю статистику по листам поисков...")
+        try:
+            count = await bulk_sheets_call(lambda: stats.rebuild(iter_search_log_rows(lot)))
+            await asyncio.to_thread(stats.save)
+            await message.answer(f"✅ Статистика пересчитана: {count} поисков.")
+        except Exception as e:
+            await message.answer(f"❌ Ошибка: {e}")
+        return
+    
+    if arg == 'all':
+        months, label = stats.months(), "за всё время"
+    elif re.fullmatch(r'\d{4}-\d{2}', arg):
+        months, label = [arg], f"за {arg}"
+    else:
+        await message.answer(
+            "⚠️ Пример: <code>/stats</code>, <code>/stats 2026-09</code>, "
+            "<code>/stats all</code>, <code>/stats rebuild</code>",
+            parse_mode="HTML"
+        )
+        return
+    
+    summary = stats.summary(months)
+    if not summary['total']:
+        await message.answer(f"📭 Поисков {label} нет.")
+        return
+    
+    response_parts = [
+        f"{lot_header(lot)}📊 <b>Статистика поисков {label}</b>\n",
+        f"🔍 Всего поисков: {summary['total']}",
+        f"❌ Без результата: {summary['zero']} ({summary['zero_rate']:.0%})\n",
+        "<b>🚗 Чаще всего ищут:</b>"
+    ]
+    for i, (plate, count) in enumerate(summary['top_plates'], start=1):
+        response_parts.append(f"{i}. <code>{html_mod.escape(get_display_plate(plate))}</code> — {count}")
+    response_parts.append("\n<b>👤 Самые активные:</b>")
+    for i, (user_id, name, count) in enumerate(summary['top_users'], start=1):
+        response_parts.append(f"{i}. {html_mod.escape(name or '—')} 🆔 <code>{user_id}</code> — {count}")
+    
+    await message.answer("\n".join(response_parts), parse_mode="HTML")
+
+
 @dp.message(Command("refresh_cache"))
 async def cmd_refresh_cache(message: Message):
     """Перестраивает кэш зарегистрированных"""
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Только для админов.")
         return
-    await sheets_call(rebuild_registered_cache)
+    lot = lot_for_user(message.from_user.id)
+    await bulk_sheets_call(lot.rebuild_registered_cache)
+    try:
+        await bulk_sheets_call(lot.residents.get, True)
+    except Exception as e:
+        logger.error(f"Ошибка чтения таблицы: {e}")
     await message.answer(
-        f"✅ Кэш обновлён.\n"
-        f"Зарегистрировано в боте: {len(REGISTERED_TG_TO_ROW)} совпадений с жильцами."
+        f"{lot_header(lot)}✅ Кэш обновлён.\n"
+        f"Зарегистрировано в боте: {len(lot.registered_tg_to_row)} совпадений с жильцами.\n"
+        f"База жильцов: {len(lot.residents.users)} записей (версия {lot.residents.version}).",
+        parse_mode="HTML"
     )
 
 
@@ -788,10 +1967,11 @@ async def cmd_highlight(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Только для админов.")
         return
+    lot = lot_for_user(message.from_user.id)
     await message.answer("🎨 Подсвечиваю зарегистрированных владельцев...")
     try:
-        await sheets_call(highlight_registered_owners, set(ROW_TO_REGISTERED_TG.keys()))
-        await message.answer(f"✅ Подсвечено строк: {len(ROW_TO_REGISTERED_TG)}.")
+        await bulk_sheets_call(highlight_registered_owners, lot, set(lot.row_to_registered_tg.keys()))
+        await message.answer(f"✅ Подсвечено строк: {len(lot.row_to_registered_tg)}.")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
@@ -802,21 +1982,75 @@ async def cmd_clear_highlight(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Только для админов.")
         return
-    try:
+    sheet = lot_for_user(message.from_user.id).sheet
+
+    def do_clear():
         all_values = sheet.get_all_values()
         if len(all_values) > 1:
             last_row = len(all_values)
             sheet.format(f'A1:E{last_row}', {
                 'backgroundColor': {'red': 1.0, 'green': 1.0, 'blue': 1.0}
             })
+
+    try:
+        await bulk_sheets_call(do_clear)
         await message.answer("✅ Подсветка сброшена.")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
 
+def cleanup_search_partitions(lot, days: int) -> tuple:
+    """Удаляет поиски старше N дней: помесячные листы целиком (один запрос на месяц),
+    а в старом общем листе — одним диапазоном, так как строки идут по времени.
+    Месяц, на который приходится граница, сохраняется целиком.
+    Возвращает (удалённые месяцы, удалённые строки старого листа)."""
+    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+    cutoff_month = cutoff_date.strftime('%Y-%m')
+    cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
+
+    dropped = []
+    legacy = None
+    for ws in lot.spreadsheet.worksheets():
+        month = partition_month(ws.title)
+        if month and month < cutoff_month and ws.title != lot.recent_searches.title:
+            lot.spreadsheet.del_worksheet(ws)
+            lot.forget_log_sheet(ws.title)
+            lot.archive_logs.pop(ws.title, None)
+            dropped.append(month)
+        elif ws.title == SEARCH_SHEET_NAME:
+            legacy = ws
+
+    legacy_deleted = 0
+    if legacy is not None:
+        for date in legacy.col_values(1)[1:]:
+            if date >= cutoff_str:
+                break
+            legacy_deleted += 1
+        if legacy_deleted:
+            legacy.delete_rows(2, legacy_deleted + 1)
+            lot.archive_logs.pop(SEARCH_SHEET_NAME, None)
+    for month in lot.search_stats.months():
+        if month < cutoff_month:
+            lot.search_stats.drop_month(month)
+    return sorted(dropped), legacy_deleted
+
+
+async def search_retention_worker():
+    """Раз в сутки удаляет месячные листы поисков старше SEARCH_RETENTION_DAYS на всех парковках"""
+    while True:
+        for lot in LOTS:
+            try:
+                dropped, legacy_deleted = await bulk_sheets_call(cleanup_search_partitions, lot, SEARCH_RETENTION_DAYS)
+                if dropped or legacy_deleted:
+                    logger.info(f"🧹 Автоочистка поисков '{lot.id}': {dropped}, старый лист: {legacy_deleted}")
+            except Exception as e:
+                logger.error(f"❌ Автоочистка поисков '{lot.id}': {e}")
+        await asyncio.sleep(24 * 3600)
+
+
 @dp.message(Command("cleanup_searches"))
 async def cmd_cleanup_searches(message: Message):
-    """Удаляет записи из листа 'Поиски' старше N дней. Пример: /cleanup_searches 30"""
+    """Удаляет поиски старше N дней (целыми месяцами). Пример: /cleanup_searches 30"""
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Только для админов.")
         return
@@ -831,36 +2065,22 @@ async def cmd_cleanup_searches(message: Message):
         return
     
     days = int(args[1])
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-    cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
-    
+    lot = lot_for_user(message.from_user.id)
     await message.answer(f"🧹 Очищаю записи старше {days} дней...")
     
     try:
-        rows = await sheets_call(search_sheet.get_all_values)
-        if len(rows) <= 1:
-            await message.answer("📭 Лист пуст.")
-            return
-
-        rows_to_delete = []
-        for idx in range(len(rows) - 1, 0, -1):
-            row = rows[idx]
-            if len(row) >= 1 and row[0] < cutoff_str:
-                rows_to_delete.append(idx + 1)
-
-        if not rows_to_delete:
+        dropped, legacy_deleted = await bulk_sheets_call(cleanup_search_partitions, lot, days)
+        if not dropped and not legacy_deleted:
             await message.answer("✅ Нечего удалять — все записи свежие.")
             return
 
-        def do_delete():
-            for row_num in rows_to_delete:
-                search_sheet.delete_rows(row_num)
-
-        await sheets_call(do_delete)
-        deleted = len(rows_to_delete)
-        
-        await message.answer(f"✅ Удалено {deleted} записей старше {days} дней.")
-        logger.info(f"🧹 Админ очистил {deleted} записей поиска")
+        parts = []
+        if dropped:
+            parts.append(f"листы за {', '.join(dropped)}")
+        if legacy_deleted:
+            parts.append(f"{legacy_deleted} записей старого листа")
+        await message.answer(f"✅ Удалено: {'; '.join(parts)}.")
+        logger.info(f"🧹 Админ очистил поиски '{lot.id}': {dropped}, старый лист: {legacy_deleted}")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
@@ -872,10 +2092,12 @@ async def cmd_cleanup_registrations(message: Message):
         await message.answer("⛔ Только для админов.")
         return
     
+    lot = lot_for_user(message.from_user.id)
+    reg_sheet = lot.reg_sheet
     await message.answer("🧹 Удаляю дубли регистраций...")
     
     try:
-        rows = await sheets_call(reg_sheet.get_all_values)
+        rows = await bulk_sheets_call(reg_sheet.get_all_values)
         if len(rows) <= 1:
             await message.answer("📭 Лист пуст.")
             return
@@ -905,107 +2127,370 @@ async def cmd_cleanup_registrations(message: Message):
             for row_num in sorted(rows_to_delete, reverse=True):
                 reg_sheet.delete_rows(row_num)
 
-        await sheets_call(do_delete)
+        await bulk_sheets_call(do_delete)
+        await bulk_sheets_call(lot.recent_registrations.seed, reg_sheet, lot.journal)
 
         await message.answer(f"✅ Удалено {len(rows_to_delete)} дублей регистраций.")
-        logger.info(f"🧹 Удалено {len(rows_to_delete)} дублей в 'Регистрации'")
+        logger.info(f"🧹 Удалено {len(rows_to_delete)} дублей в 'Регистрации' ({lot.id})")
 
         # Обновляем кэш
-        await sheets_call(rebuild_registered_cache)
+        await bulk_sheets_call(lot.rebuild_registered_cache)
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
 
-# ======== KEEP-ALIVE ========
-ping_failures = 0
-PING_INTERVAL = 120
-MAX_FAILURES = 5
+# ======== HTTP-СЕРВЕР (health, метрики, API, вебхук) ========
+# Одно aiohttp-приложение на event loop бота вместо отдельного потока
+_webhook_tasks = set()
 
 
-async def self_ping():
-    global ping_failures
-    render_url = os.environ.get('RENDER_EXTERNAL_URL')
-    if not render_url:
-        logger.info("💤 Self-ping отключён (не PaaS, RENDER_EXTERNAL_URL не задан)")
-        return
-    health_url = f"{render_url}/health"
+async def health_handler(request):
+    return web.Response(text='OK')
 
-    logger.info("💪 Keep-Alive активен:")
-    logger.info(f"   - Интервал: {PING_INTERVAL} сек")
-    logger.info(f"   - URL: {health_url}")
-    
-    while True:
+
+async def ping_handler(request):
+    return web.Response(text='PONG')
+
+
+async def metrics_handler(request):
+    """Метрики в текстовом формате Prometheus; по парковкам — с меткой lot"""
+    per_lot = {
+        lot.id: {
+            'registered_users': lot.registered_count,
+            'journal_pending': len(lot.journal) if lot.journal is not None else 0,
+            'residents_snapshot_version': lot.residents.version,
+            'query_cache_entries': len(lot.query_cache),
+        }
+        for lot in LOTS
+    }
+    gauges = {
+        'uptime_seconds': round(time.monotonic() - STARTED_AT, 1),
+        'updates_in_flight': UPDATE_GATE.active,
+        'updates_pending': UPDATE_GATE.pending,
+        'sheets_bulk_active': BULK_SHEETS_ACTIVE,
+        'webhook_mode': int(bool(WEBHOOK_URL)),
+        'fsm_states': storage.size,
+        'health_consecutive_failures': HEALTH.failures,
+        'notifications_pending': NOTIFIER.pending,
+        'lots': len(LOTS),
+    }
+    # Без метки — сумма по всем парковкам (для одной парковки — как раньше)
+    for values in per_lot.values():
+        for name, value in values.items():
+            gauges[name] = gauges.get(name, 0) + value
+    lookups = METRICS['query_cache_hits'] + METRICS['query_cache_misses']
+    gauges['query_cache_hit_ratio'] = round(METRICS['query_cache_hits'] / lookups, 4) if lookups else 0
+    lines = []
+    for name, value in sorted({**METRICS, **gauges}.items()):
+        lines.append(f"parking_bot_{name} {value}")
+    for lot_id, values in per_lot.items():
+        for name, value in sorted(values.items()):
+            lines.append(f'parking_bot_lot_{name}{{lot="{lot_id}"}} {value}')
+    return web.Response(text="\n".join(lines) + "\n", content_type='text/plain')
+
+
+async def stats_handler(request):
+    """Статистика: сколько пользователей в базе, всего и по парковкам"""
+    try:
+        lots = {}
+        for lot in LOTS:
+            data = await sheets_call(lot.residents.get)
+            lots[lot.id] = {"users": len(data.users), "registered": lot.registered_count}
+        return web.json_response({
+            "status": "ok",
+            "users": sum(item["users"] for item in lots.values()),
+            "registered": sum(item["registered"] for item in lots.values()),
+            "lots": lots,
+            "bot": "running"
+        })
+    except Exception as e:
+        return web.json_response({"status": "error", "msg": str(e)}, status=500)
+
+
+async def search_handler(request):
+    """Поиск владельцев по части гос. номера через HTTP API"""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not API_TOKEN or token != API_TOKEN:
+        return web.json_response({"error": "unauthorized"}, status=401)
+    plate = request.query.get('plate', '').strip()
+    if not plate:
+        return web.json_response({"error": "use ?plate=А123БВ777[&lot=id]"}, status=400)
+    # Без lot= — по всем парковкам
+    lot_id = request.query.get('lot')
+    if lot_id and lot_id not in LOTS_BY_ID:
+        return web.json_response({"error": f"unknown lot '{lot_id}'"}, status=404)
+    lots = [LOTS_BY_ID[lot_id]] if lot_id else LOTS
+    found = [(lot, await search_plate(lot, plate)) for lot in lots]
+    METRICS['api_searches_total'] += 1
+    # Похожие номера — только если точных совпадений нет ни на одной парковке
+    exact = [(lot, entry) for lot, entry in found if entry['results'] and not entry['fuzzy']]
+    found = exact or [(lot, entry) for lot, entry in found if entry['results']]
+    if not found:
+        return web.json_response({"found": False, "results": []}, status=404)
+    return web.json_response({
+        "found": True,
+        "fuzzy": not exact,
+        "results": [{
+            "lot": lot.id,
+            "plate": get_display_plate(r['plate_raw']),
+            "fio": mask_fio(r['fio']),
+            "phone": r['phone'],
+            "category": r['category']
+        } for lot, entry in found for r in entry['results']]
+    })
+
+
+async def process_webhook_update(update: Update):
+    try:
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}")
+
+
+async def webhook_handler(request):
+    """Принимает апдейт от Telegram и отвечает 200, не дожидаясь обработки:
+    она идёт в фоне под лимитами UPDATE_GATE."""
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not secrets.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        return web.Response(status=401)
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+    except ValueError:
+        # Битый JSON (json.JSONDecodeError) или не апдейт (pydantic.ValidationError)
+        return web.Response(status=400)
+    # Пока очередь полна, не отвечаем — Telegram придержит следующие апдейты
+    await UPDATE_GATE.wait_for_capacity()
+    task = asyncio.create_task(process_webhook_update(update))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+    return web.Response(text='OK')
+
+
+def create_web_app(with_webhook: bool = True) -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', health_handler)
+    app.router.add_get('/health', health_handler)
+    app.router.add_get('/ping', ping_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/stats', stats_handler)
+    app.router.add_get('/search', search_handler)
+    if with_webhook and WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    return app
+
+
+# ======== КОНТРОЛЬ ЗДОРОВЬЯ ========
+def sd_notify(message: str) -> bool:
+    """Сообщение systemd (READY=1, WATCHDOG=1, STATUS=...) через NOTIFY_SOCKET.
+    Вне systemd ничего не делает."""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # абстрактный сокет Linux
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            # Не блокируем event loop, даже если systemd не успевает читать
+            sock.setblocking(False)
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"⚠️ sd_notify: {e}")
+        return False
+
+
+def watchdog_interval():
+    """Как часто слать WATCHDOG=1: треть WatchdogSec из юнита, None — watchdog выключен"""
+    usec = os.environ.get('WATCHDOG_USEC')
+    if not usec or not os.environ.get('NOTIFY_SOCKET'):
+        return None
+    pid = os.environ.get('WATCHDOG_PID')
+    if pid and int(pid) != os.getpid():
+        return None
+    return int(usec) / 1_000_000 / 3
+
+
+class HealthSupervisor:
+    """Одна фоновая задача вместо self_ping и keep_alive_monitor.
+
+    Проверяет Telegram (getMe), локальный /health и, если задан,
+    HEALTH_EXTERNAL_URL через одну общую aiohttp-сессию. Пока всё в порядке,
+    интервал проверок растёт до HEALTH_INTERVAL, после ошибки — сбрасывается
+    до HEALTH_MIN_INTERVAL. После каждых HEALTH_MAX_FAILURES ошибок Telegram подряд
+    закрывает сессию aiogram (она пересоздаётся при следующем запросе с теми же
+    настройками и middleware). Пока цикл жив и Telegram отвечал не дольше
+    HEALTH_UNHEALTHY_TIMEOUT назад, шлёт systemd WATCHDOG=1 — иначе systemd
+    перезапустит зависший бот.
+    """
+
+    def __init__(self):
+        self.http = None  # общая aiohttp-сессия для HTTP-проверок
+        self.failures = 0
+        self.interval = HEALTH_MIN_INTERVAL
+        self.last_ok = time.monotonic()
+
+    async def check_telegram(self) -> bool:
         try:
-            try:
-                me = await bot.get_me()
-                logger.debug(f"💓 Telegram ping OK: @{me.username}")
-            except Exception as e:
-                logger.warning(f"⚠️ Telegram ping: {e}")
-                ping_failures += 1
-            
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get('http://localhost:8080/health', timeout=5) as resp:
-                        if resp.status == 200:
-                            logger.debug("💚 Local health OK")
-                        else:
-                            ping_failures += 1
-            except Exception:
-                pass
-            
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(health_url, timeout=10) as resp:
-                        if resp.status == 200:
-                            logger.debug("🌐 External ping OK")
-                        else:
-                            ping_failures += 1
-            except Exception:
-                pass
-            
-            if ping_failures >= MAX_FAILURES:
-                logger.warning(f"⚠️ {ping_failures} ошибок, перезапуск сессии...")
-                try:
-                    await bot.session.close()
-                    bot.session = aiohttp.ClientSession()
-                    await bot.get_me()
-                    ping_failures = 0
-                    logger.info("✅ Сессия восстановлена")
-                except Exception as e:
-                    logger.error(f"❌ Восстановление: {e}")
-                    ping_failures = 0
-            
-            if ping_failures == 0:
-                logger.info(f"💓 Self-ping OK")
-        
+            await bot.get_me(request_timeout=10)
+            return True
         except Exception as e:
-            logger.error(f"❌ Self-ping error: {e}")
-            ping_failures += 1
-        
-        await asyncio.sleep(PING_INTERVAL)
+            logger.warning(f"⚠️ Telegram не отвечает: {e}")
+            return False
 
+    async def check_url(self, url: str) -> bool:
+        try:
+            async with self.http.get(url) as resp:
+                return resp.status == 200
+        except Exception as e:
+            logger.warning(f"⚠️ Health {url}: {e}")
+            return False
 
-async def keep_alive_monitor():
-    while True:
+    async def reset_telegram_session(self):
+        logger.warning(f"⚠️ {self.failures} ошибок Telegram подряд, пересоздаю сессию...")
+        METRICS['telegram_session_resets'] += 1
         try:
-            await bot.get_me()
-            await asyncio.sleep(60)
+            # AiohttpSession сама откроет новое соединение при следующем запросе
+            await bot.session.close()
+            await bot.get_me(request_timeout=10)
+            self.failures = 0
+            logger.info("✅ Сессия восстановлена")
         except Exception as e:
-            logger.error(f"❌ Бот не отвечает: {e}")
-            await asyncio.sleep(10)
+            logger.error(f"❌ Восстановление: {e}")
+
+    async def check(self) -> bool:
+        telegram_ok = await self.check_telegram()
+        local_ok = await self.check_url(f"http://127.0.0.1:{WEB_PORT}/health")
+        external_ok = await self.check_url(f"{HEALTH_EXTERNAL_URL}/health") if HEALTH_EXTERNAL_URL else True
+
+        if telegram_ok:
+            self.last_ok = time.monotonic()
+            self.failures = 0
+        else:
+            self.failures += 1
+            if self.failures % HEALTH_MAX_FAILURES == 0:
+                await self.reset_telegram_session()
+
+        healthy = telegram_ok and local_ok and external_ok
+        if not healthy:
+            METRICS['health_check_failures'] += 1
+        return healthy
+
+    def watchdog_ok(self) -> bool:
+        return time.monotonic() - self.last_ok < HEALTH_UNHEALTHY_TIMEOUT
+
+    async def run(self):
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+        watchdog = watchdog_interval()
+        if watchdog:
+            logger.info(f"🐕 systemd watchdog: WATCHDOG=1 раз в {watchdog:.0f} сек")
+        next_check = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_check:
+                    if await self.check():
+                        self.interval = min(self.interval * 2, HEALTH_INTERVAL)
+                        logger.debug("💓 Health OK")
+                    else:
+                        self.interval = HEALTH_MIN_INTERVAL
+                    next_check = time.monotonic() + self.interval
+                    sd_notify(f"STATUS={'OK' if self.failures == 0 else f'Telegram: {self.failures} ошибок подряд'}")
+                if watchdog and self.watchdog_ok():
+                    sd_notify("WATCHDOG=1")
+                await asyncio.sleep(min(self.interval, watchdog or self.interval))
+        finally:
+            await self.http.close()
+
+
+HEALTH = HealthSupervisor()
+# Фоновая отправка журнала; при остановке её нужно дождаться до flush_journal()
+_journal_task = None
+# Фоновое сохранение FSM; при остановке его снимаем до последнего storage.close()
+_fsm_task = None
 
 
 async def on_startup():
+    global _journal_task, _fsm_task
     me = await bot.get_me()
     logger.info(f"✅ Бот запущен: @{me.username}")
-    asyncio.create_task(self_ping())
-    asyncio.create_task(keep_alive_monitor())
-    logger.info("💪 Keep-Alive активен")
+    asyncio.create_task(HEALTH.run())
+    _journal_task = asyncio.create_task(journal_worker())
+    asyncio.create_task(stats_worker())
+    _fsm_task = asyncio.create_task(fsm_worker())
+    if RESIDENTS_SNAPSHOT_MODE == 'write':
+        asyncio.create_task(residents_worker())
+    if SEARCH_RETENTION_DAYS:
+        asyncio.create_task(search_retention_worker())
+    sd_notify("READY=1")
+
+
+async def on_shutdown():
+    sd_notify("STOPPING=1")
+    await NOTIFIER.flush(timeout=5)
+    for task in (_journal_task, _fsm_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    # Отправка, начатая воркером в потоке, могла не закончиться — replay() дождётся её сам
+    await flush_journal()
+    for lot in LOTS:
+        lot.search_stats.save()
+    # Dispatcher уже закрыл хранилище до нашего хендлера, но в polling-режиме
+    # апдейты ещё дорабатывают: дожидаемся их и сохраняем то, что они успели
+    left = await UPDATE_GATE.drain(timeout=10)
+    if left:
+        logger.warning(f"⚠️ Остановка: не дождались апдейтов: {left}")
+    await storage.close()
+
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 
 # ======== ЗАПУСК ========
+async def run_webhook():
+    """Webhook-режим: Telegram сам присылает апдейты на WEBHOOK_URL + WEBHOOK_PATH"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await dp.emit_startup(bot=bot)
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=MAX_CONCURRENT_UPDATES,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"🌐 Webhook: {WEBHOOK_URL}{WEBHOOK_PATH}")
+    try:
+        await stop_event.wait()
+    finally:
+        if _webhook_tasks:
+            await asyncio.gather(*_webhook_tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
 if __name__ == "__main__":
     async def main():
-        dp.startup.register(on_startup)
-        await dp.start_polling(bot)
+        runner = web.AppRunner(create_web_app())
+        await runner.setup()
+        await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+        logger.info(f"🏥 HTTP-сервер запущен на порту {WEB_PORT}")
+        try:
+            if WEBHOOK_URL:
+                await run_webhook()
+            else:
+                await bot.delete_webhook()
+                await dp.start_polling(bot)
+        finally:
+            await runner.cleanup()
     asyncio.run(main())
@@ -15,7 +15,10 @@ apt-get install -y python3 python3-venv python3-pip git
 echo "==> Копирование проекта в $APP_DIR"
 mkdir -p "$APP_DIR"
 # Предполагается, что скрипт запущен из корня репозитория
-cp -r bot.py requirements.txt .env "$APP_DIR"/
+cp -r bot.py journal.py search_stats.py plate_index.py fsm_storage.py snapshot_file.py logging_setup.py web_server.py requirements.txt .env "$APP_DIR"/
+# Локальные данные бота (журнал записей в Sheets); сервис работает от ubuntu
+mkdir -p "$APP_DIR/data"
+chown ubuntu:ubuntu "$APP_DIR/data"
 
 if [ ! -f "$APP_DIR/.env" ]; then
     echo "ОШИБКА: положи .env рядом с setup-vps.sh"; exit 1
@@ -0,0 +1,123 @@
+"""Хранилище состояний FSM в SQLite, переживающее рестарт бота.
+
+Все состояния держатся в памяти — чтение не ходит в базу. Изменения
+копятся и записываются одной транзакцией в flush(), который бот вызывает
+в фоне раз в несколько секунд и при остановке. При аварийном завершении
+теряются только изменения за последний интервал.
+"""
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+logger = logging.getLogger(__name__)
+
+
+def _key_str(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Запись в базу — под отдельным замком: set_state/set_data её не ждут,
+        # а два flush() подряд не перепишут новые строки старыми
+        self._write_lock = threading.Lock()
+        self._states = {}  # строка ключа -> состояние
+        self._data = {}    # строка ключа -> данные
+        self._dirty = set()
+        self._conn = self._connect()
+        for key, state, data in self._conn.execute("SELECT key, state, data FROM fsm"):
+            if state:
+                self._states[key] = state
+            if data:
+                self._data[key] = json.loads(data)
+        if self._states:
+            logger.info(f"💾 FSM: восстановлено состояний: {len(self._states)}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)")
+        return conn
+
+    @property
+    def size(self) -> int:
+        # Не __len__: Dispatcher проверяет storage на истинность, и пустое
+        # хранилище молча заменилось бы на MemoryStorage
+        return len(self._states)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        name = _key_str(key)
+        with self._lock:
+            if state is None:
+                self._states.pop(name, None)
+            else:
+                self._states[name] = state
+            self._dirty.add(name)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._states.get(_key_str(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = _key_str(key)
+        with self._lock:
+            if data:
+                self._data[name] = data.copy()
+            else:
+                self._data.pop(name, None)
+            self._dirty.add(name)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._data.get(_key_str(key), {}).copy()
+
+    def flush(self) -> int:
+        """Записывает накопленные изменения одной транзакцией. Синхронный,
+        вызывать в потоке. Возвращает число записанных ключей."""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                keys, self._dirty = self._dirty, set()
+                rows = [(name, self._states.get(name), self._data.get(name)) for name in keys]
+            # Хранилище уже закрыто, а апдейты ещё дорабатывают — открываем заново
+            if self._conn is None:
+                self._conn = self._connect()
+            upserts, deletes = [], []
+            for name, state, data in rows:
+                if state is None and not data:
+                    deletes.append((name,))
+                else:
+                    upserts.append((name, state, json.dumps(data, ensure_ascii=False) if data else None))
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO fsm (key, state, data) VALUES (?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                        upserts
+                    )
+                    self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            except sqlite3.Error:
+                # Не записалось — попробуем в следующий раз
+                with self._lock:
+                    self._dirty |= keys
+                raise
+        return len(keys)
+
+    async def close(self) -> None:
+        """Сохраняет изменения и закрывает базу. Можно вызывать повторно:
+        Dispatcher закрывает хранилище сам, а бот — ещё раз, дождавшись
+        апдейтов, которые к тому моменту ещё обрабатывались."""
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"❌ FSM: не удалось сохранить состояния: {e}")
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,223 @@
+"""Локальный журнал записей в Google Sheets (write-ahead log).
+
+Каждая строка для листа сначала дописывается в append-only файл и только
+потом, пачками, уходит в Sheets. Если Google недоступен или процесс упал,
+записи остаются в файле и досылаются позже (в том числе после рестарта).
+
+Формат файла — JSON Lines:
+    {"k": "<ключ>", "s": "<лист>", "r": [...]}   — запись
+    {"ack": ["<ключ>", ...]}                       — подтверждение отправки
+
+Подтверждения копятся в файле, пока в журнале есть неотправленные записи.
+Когда их набирается compact_after, файл переписывается только с
+неотправленными записями (временный файл + os.replace) — иначе при
+постоянном потоке он рос бы без предела и долго читался при старте.
+
+Ключ записи (ключ идемпотентности) уходит в Sheets последним столбцом строки.
+Если неизвестно, дошла ли прошлая пачка (ошибка посреди запроса или падение
+процесса), перед повторной отправкой этот столбец читается и уже записанные
+строки пропускаются.
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsJournal:
+    def __init__(self, path: str, compact_after: int = 10000):
+        self.path = path
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        # replay() целиком под своей блокировкой: иначе две параллельные отправки
+        # (фоновая и при остановке) возьмут одни и те же записи
+        self._replay_lock = threading.Lock()
+        self._pending = {}  # ключ -> (лист, строка), в порядке записи
+        self._dirty = False
+        self._acked = 0  # подтверждённых записей в файле с последнего сжатия
+        # После рестарта не знаем, какие записи успели дойти до Sheets
+        self.needs_verify = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # Недописанная строка после аварийного завершения
+                    logger.warning(f"⚠️ Журнал {self.path}: пропущена битая строка {line_no}")
+                    continue
+                if 'ack' in item:
+                    for key in item['ack']:
+                        self._pending.pop(key, None)
+                    self._acked += len(item['ack'])
+                else:
+                    self._pending[item['k']] = (item['s'], item['r'])
+        if self._pending:
+            self.needs_verify = True
+            logger.info(f"📒 Журнал: {len(self._pending)} неотправленных записей с прошлого запуска")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _record(key: str, sheet_title: str, row: list) -> str:
+        return json.dumps({'k': key, 's': sheet_title, 'r': row}, ensure_ascii=False) + '\n'
+
+    def append(self, sheet_title: str, row: list) -> str:
+        """Дописывает строку в журнал. Не ходит в сеть и не делает fsync —
+        это делают sync() и replay() в фоне."""
+        # Буквенный префикс, чтобы USER_ENTERED не превратил ключ в число
+        key = 'j' + uuid.uuid4().hex[:15]
+        row = ['' if v is None else v for v in row]
+        line = self._record(key, sheet_title, row)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._pending[key] = (sheet_title, row)
+            self._dirty = True
+        return key
+
+    def sync(self):
+        """fsync накопленных записей (одна операция на пачку)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = os.dup(self._file.fileno())
+        self._fsync(fd)
+
+    def _fsync(self, fd: int):
+        # Без self._lock: append() вызывается из event loop и не должен ждать диск.
+        # fd — копия (os.dup): сжатие может тем временем заменить self._file
+        try:
+            os.fsync(fd)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+            raise
+        finally:
+            os.close(fd)
+
+    def pending_rows(self, sheet_title: str) -> list:
+        with self._lock:
+            return [row for title, row in self._pending.values() if title == sheet_title]
+
+    def pending_items(self, sheet_title: str) -> list:
+        """[(ключ, строка), ...] ещё не отправленных записей листа"""
+        with self._lock:
+            return [(key, row) for key, (title, row) in self._pending.items() if title == sheet_title]
+
+    def replay(self, resolve_worksheet, batch_size: int = 500) -> int:
+        """Отправляет до batch_size записей в Sheets одним append_rows на лист.
+        Синхронный, вызывать в потоке. Возвращает число подтверждённых записей."""
+        with self._replay_lock:
+            return self._replay(resolve_worksheet, batch_size)
+
+    def _replay(self, resolve_worksheet, batch_size: int) -> int:
+        with self._lock:
+            batch = list(self._pending.items())[:batch_size]
+        if not batch:
+            return 0
+
+        by_sheet = {}
+        for key, (title, row) in batch:
+            by_sheet.setdefault(title, []).append((key, row))
+
+        acked = 0
+        for title, items in by_sheet.items():
+            ws = resolve_worksheet(title)
+            width = max(len(row) for _, row in items)
+            key_col = width + 1
+
+            to_send = items
+            if self.needs_verify:
+                existing = set(ws.col_values(key_col))
+                to_send = [(key, row) for key, row in items if key not in existing]
+
+            if to_send:
+                if ws.col_count < key_col:
+                    ws.add_cols(key_col - ws.col_count)
+                rows = [row + [''] * (width - len(row)) + [key] for key, row in to_send]
+                try:
+                    ws.append_rows(rows, value_input_option='USER_ENTERED')
+                except Exception:
+                    # Запрос мог выполниться, а ответ потеряться — перед повтором сверимся
+                    self.needs_verify = True
+                    raise
+            self._ack([key for key, _ in items])
+            acked += len(items)
+
+        if len(batch) < batch_size:
+            # Все записи, которые могли дойти до Sheets, сверены
+            self.needs_verify = False
+        return acked
+
+    def _ack(self, keys: list):
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            if self._pending:
+                self._file.write(json.dumps({'ack': keys}) + '\n')
+                self._file.flush()
+                self._acked += len(keys)
+            else:
+                # Всё отправлено — журнал можно обнулить
+                self._file.truncate(0)
+                self._acked = 0
+            self._dirty = False
+            fd = os.dup(self._file.fileno())
+            compact = self._acked >= self.compact_after
+        self._fsync(fd)
+        if compact:
+            self._compact()
+
+    def _compact(self):
+        """Переписывает файл только с неотправленными записями. Вызывается
+        из replay(), поэтому подтверждений в это время не бывает."""
+        tmp = self.path + '.tmp'
+        with self._lock:
+            items = list(self._pending.items())
+        # Основная часть пишется и fsync-ится без self._lock
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for key, (title, row) in items:
+                    f.write(self._record(key, title, row))
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            # Старый файл цел — попробуем при следующем подтверждении
+            logger.warning(f"⚠️ Журнал {self.path}: не удалось сжать: {e}")
+            return
+        written = {key for key, _ in items}
+        with self._lock:
+            # Записи, пришедшие во время записи файла, дописываем; fsync — в sync()
+            os.replace(tmp, self.path)
+            self._file.close()
+            self._file = open(self.path, 'a', encoding='utf-8')
+            for key, (title, row) in self._pending.items():
+                if key not in written:
+                    self._file.write(self._record(key, title, row))
+            self._file.flush()
+            self._dirty = True
+            self._acked = 0
+        self.sync()
+        # Переименование переживёт сбой питания только после fsync каталога
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        logger.info(f"📒 Журнал {self.path}: сжат до {len(items)} записей")
+
+    def close(self):
+        self.sync()
+        self._file.close()
@@ -0,0 +1,6 @@
+"""Офлайн-стенд для нагрузочного тестирования бота.
+
+Подменяет Google Sheets и Telegram локальными заглушками и прогоняет
+синтетических жильцов через ``Dispatcher.feed_update``.
+Запуск: ``python -m loadtest --users 50``.
+"""
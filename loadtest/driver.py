@@ -0,0 +1,259 @@
+"""Нагрузочный прогон: N жильцов одновременно регистрируются, ищут и листают.
+
+Пример:
+    python -m loadtest --users 100 --base 2000 --sheets-latency 0.25 --quota 300
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import asyncio
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+from aiogram.types import Update
+
+from loadtest.fake_sheets import FakeSheetsBackend
+from loadtest.fake_telegram import FakeTelegramSession
+
+SPREADSHEET_KEY = 'loadtest-spreadsheet'
+MAIN_SHEET = 'Лист1'
+RESIDENT_ID_BASE = 100000
+PLATE_LETTERS = 'АВЕКМНОРСТУХ'
+REGIONS = ['77', '97', '177', '777', '50', '750']
+
+
+def make_plate(rng: random.Random) -> str:
+    return (rng.choice(PLATE_LETTERS) + f"{rng.randint(1, 999):03d}"
+            + rng.choice(PLATE_LETTERS) + rng.choice(PLATE_LETTERS) + rng.choice(REGIONS))
+
+
+def make_resident_base(size: int, rng: random.Random) -> list:
+    """Строки листа жильцов: ID, гос. номер, ФИО, телефон, категория"""
+    rows = [['ID', 'Гос. номер', 'ФИО', 'Телефон', 'Категория']]
+    for i in range(size):
+        plates = make_plate(rng)
+        if rng.random() < 0.15:
+            plates += ', ' + make_plate(rng)
+        rows.append([
+            str(i + 1),
+            plates,
+            f"Жителев{i} Иван Петрович",
+            f"8900{i:07d}",
+            rng.choice(['Жилец', 'Арендатор', 'Гость']),
+        ])
+    return rows
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class LoadDriver:
+    """Строит синтетические апдейты и замеряет время их обработки"""
+
+    def __init__(self, app, base_rows: list, args):
+        self.app = app
+        self.base_rows = base_rows
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._update_id = 0
+        self._message_id = 0
+        # "Машина у шлагбаума": несколько популярных номеров, которые ищут чаще всего
+        plates = [row[1].split(',')[0] for row in base_rows[1:]]
+        self.hot_queries = [p[1:4] for p in rng_sample(self.rng, plates, 5)]
+        self.all_plates = plates
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(tg_id: int) -> dict:
+        return {'id': tg_id, 'is_bot': False, 'first_name': f"Житель{tg_id}", 'username': f"resident{tg_id}"}
+
+    def message_update(self, tg_id: int, **fields) -> Update:
+        update_id, message_id = self._next_ids()
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': tg_id, 'type': 'private'},
+            'from': self._user(tg_id),
+        }
+        message.update(fields)
+        return Update.model_validate({'update_id': update_id, 'message': message},
+                                     context={'bot': self.app.bot})
+
+    def callback_update(self, tg_id: int, data: str) -> Update:
+        update_id, message_id = self._next_ids()
+        return Update.model_validate({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(tg_id),
+                'chat_instance': str(tg_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': tg_id, 'type': 'private'},
+                    'from': {'id': self.app.bot.id, 'is_bot': True, 'first_name': 'Parking'},
+                    'text': '🔍',
+                },
+            },
+        }, context={'bot': self.app.bot})
+
+    async def feed(self, kind: str, update: Update):
+        started = time.perf_counter()
+        try:
+            await self.app.dp.feed_update(self.app.bot, update)
+        except Exception as e:
+            self.errors[f"{kind}: {type(e).__name__}"] += 1
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    def pick_query(self) -> str:
+        if self.rng.random() < 0.6:
+            return self.rng.choice(self.hot_queries)
+        plate = self.rng.choice(self.all_plates)
+        start = self.rng.randint(0, max(0, len(plate) - 4))
+        return plate[start:start + self.rng.randint(3, 6)]
+
+    async def resident(self, idx: int):
+        if self.args.ramp:
+            await asyncio.sleep(self.rng.uniform(0, self.args.ramp))
+        tg_id = RESIDENT_ID_BASE + idx
+        row = self.base_rows[1 + idx % (len(self.base_rows) - 1)]
+        phone = row[3]
+
+        await self.feed('start', self.message_update(
+            tg_id, text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}]))
+        await self.feed('registration', self.message_update(
+            tg_id, contact={'phone_number': phone, 'first_name': f"Житель{tg_id}", 'user_id': tg_id}))
+
+        for _ in range(self.args.searches):
+            await self.feed('search', self.message_update(tg_id, text=self.pick_query()))
+            if self.args.think:
+                await asyncio.sleep(self.rng.uniform(0, self.args.think))
+
+        # Широкий запрос по региону — гарантированно несколько страниц
+        await self.feed('search', self.message_update(tg_id, text=self.rng.choice(REGIONS)))
+        await self.feed('pagination', self.callback_update(tg_id, 'search_page_1'))
+
+    async def run(self) -> float:
+        # Фоновые задачи бота (журнал записей и т.п.) работают как в проде
+        await self.app.dp.emit_startup(bot=self.app.bot)
+        started = time.perf_counter()
+        await asyncio.gather(*(self.resident(i) for i in range(self.args.users)))
+        elapsed = time.perf_counter() - started
+        await self.app.dp.emit_shutdown(bot=self.app.bot)
+        return elapsed
+
+
+def rng_sample(rng: random.Random, items: list, k: int) -> list:
+    return rng.sample(items, min(k, len(items)))
+
+
+def print_report(driver: LoadDriver, backend: FakeSheetsBackend, session: FakeTelegramSession,
+                 elapsed: float, sheets_calls_at_start: Counter):
+    total_updates = sum(len(v) for v in driver.latencies.values())
+    print()
+    print(f"Жильцов: {driver.args.users}, апдейтов: {total_updates}, "
+          f"время: {elapsed:.2f} с, {total_updates / elapsed:.1f} апдейтов/с")
+    print()
+    print(f"{'шаг':<14}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for kind, values in driver.latencies.items():
+        print(f"{kind:<14}{len(values):>8}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    print()
+    run_calls = backend.calls - sheets_calls_at_start
+    total_calls = sum(run_calls.values())
+    print(f"Вызовы Google Sheets за прогон: {total_calls} "
+          f"({total_calls / max(total_updates, 1):.2f} на апдейт)")
+    for op, count in run_calls.most_common():
+        print(f"   {op:<20}{count:>8}")
+    print(f"   отказов по квоте: {backend.quota_errors}, внедрённых ошибок: {backend.injected_errors}")
+    print()
+    print(f"Вызовы Telegram: {sum(session.calls.values())}")
+    for method, count in session.calls.most_common():
+        print(f"   {method:<20}{count:>8}")
+    metrics = getattr(driver.app, 'METRICS', None)
+    if metrics:
+        print()
+        print("Метрики бота:")
+        for name, value in sorted(metrics.items()):
+            print(f"   {name:<28}{value:>8}")
+    if driver.errors:
+        print()
+        print("Необработанные исключения в хендлерах:")
+        for key, count in sorted(driver.errors.items()):
+            print(f"   {key}: {count}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='одновременных жильцов')
+    parser.add_argument('--base', type=int, default=1000, help='строк в базе жильцов')
+    parser.add_argument('--searches', type=int, default=5, help='поисков на жильца')
+    parser.add_argument('--admins', type=int, default=2, help='админов для уведомлений')
+    parser.add_argument('--ramp', type=float, default=0.0, help='разброс старта жильцов, с')
+    parser.add_argument('--think', type=float, default=0.0, help='пауза между поисками, с')
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help='задержка вызова Sheets, с')
+    parser.add_argument('--sheets-jitter', type=float, default=0.05, help='случайная добавка к задержке, с')
+    parser.add_argument('--quota', type=int, default=0, help='лимит вызовов Sheets в минуту (0 — без лимита)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля вызовов Sheets с ошибкой 500')
+    parser.add_argument('--tg-latency', type=float, default=0.03, help='задержка вызова Telegram, с')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='не глушить логи бота')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    base_rows = make_resident_base(args.base, rng)
+
+    backend = FakeSheetsBackend(latency=args.sheets_latency, jitter=args.sheets_jitter, seed=args.seed)
+    backend.add_spreadsheet(SPREADSHEET_KEY, {MAIN_SHEET: base_rows})
+    backend.install()
+
+    os.environ.update({
+        'TELEGRAM_TOKEN': '123456:LOADTEST',
+        'SPREADSHEET_ID': SPREADSHEET_KEY,
+        'SHEET_NAME': MAIN_SHEET,
+        'GOOGLE_CREDS_JSON': '{}',
+        'ADMIN_IDS': ','.join(str(i + 1) for i in range(args.admins)),
+        'DATA_DIR': tempfile.mkdtemp(prefix='parking-loadtest-'),
+    })
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    # Импорт после подмены: bot.py подключается к Sheets на уровне модуля
+    import bot as app
+
+    # Квота и ошибки включаются после старта, чтобы не уронить init_gsheets()
+    backend.quota_per_minute = args.quota
+    backend.error_rate = args.error_rate
+
+    session = FakeTelegramSession(latency=args.tg_latency)
+    app.bot.session = session
+
+    driver = LoadDriver(app, base_rows, args)
+    sheets_calls_at_start = Counter(backend.calls)
+    elapsed = asyncio.run(driver.run())
+    print_report(driver, backend, session, elapsed, sheets_calls_at_start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
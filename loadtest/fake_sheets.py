@@ -0,0 +1,201 @@
+"""Локальная подмена gspread: листы в памяти с задержкой, квотой и ошибками."""
+import re
+import time
+import random
+import threading
+from collections import Counter, deque
+
+import gspread
+from google.oauth2.service_account import Credentials
+
+
+class _FakeResponse:
+    """Минимальный аналог requests.Response для gspread.exceptions.APIError"""
+
+    def __init__(self, code: int, status: str, message: str):
+        self.status_code = code
+        self._payload = {'error': {'code': code, 'status': status, 'message': message}}
+        self.text = message
+
+    def json(self):
+        return self._payload
+
+
+def _api_error(code: int, status: str, message: str) -> gspread.exceptions.APIError:
+    return gspread.exceptions.APIError(_FakeResponse(code, status, message))
+
+
+def _row_index(a1: str) -> int:
+    """Номер строки из A1-адреса ('B12' -> 12, 'A' -> 0)"""
+    digits = re.sub(r'\D', '', a1)
+    return int(digits) if digits else 0
+
+
+class FakeSheetsBackend:
+    """Общее состояние всех фейковых таблиц и счётчики вызовов.
+
+    latency / jitter — задержка одного вызова в секундах (time.sleep, как
+    реальный сетевой запрос в потоке), quota_per_minute — лимит запросов
+    в скользящем окне 60 сек (сверх него APIError 429), error_rate — доля
+    вызовов, завершающихся APIError 500.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 quota_per_minute: int = 0, error_rate: float = 0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.quota_errors = 0
+        self.injected_errors = 0
+        self.spreadsheets = {}
+        self._rng = random.Random(seed)
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    # ---- подключение ----
+    def install(self):
+        """Подменяет авторизацию gspread, чтобы init_gsheets() получил фейк"""
+        backend = self
+        gspread.authorize = lambda creds, *args, **kwargs: FakeClient(backend)
+        Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: None)
+
+    def add_spreadsheet(self, key: str, sheets: dict) -> 'FakeSpreadsheet':
+        """sheets: {название листа: список строк}"""
+        spreadsheet = FakeSpreadsheet(self, key)
+        for title, rows in sheets.items():
+            ws = spreadsheet._create(title, max(len(rows), 1000), 26)
+            ws._rows = [[str(v) for v in row] for row in rows]
+        self.spreadsheets[key] = spreadsheet
+        return spreadsheet
+
+    # ---- учёт вызовов ----
+    def _call(self, op: str):
+        with self._lock:
+            self.calls[op] += 1
+            if self.quota_per_minute:
+                now = time.monotonic()
+                while self._window and now - self._window[0] > 60:
+                    self._window.popleft()
+                if len(self._window) >= self.quota_per_minute:
+                    self.quota_errors += 1
+                    raise _api_error(429, 'RESOURCE_EXHAUSTED', 'Quota exceeded (fake)')
+                self._window.append(now)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.injected_errors += 1
+            raise _api_error(500, 'INTERNAL', 'Injected error (fake)')
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeClient:
+    def __init__(self, backend: FakeSheetsBackend):
+        self.backend = backend
+
+    def open_by_key(self, key: str) -> 'FakeSpreadsheet':
+        self.backend._call('open_by_key')
+        if key not in self.backend.spreadsheets:
+            raise gspread.SpreadsheetNotFound(key)
+        return self.backend.spreadsheets[key]
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend: FakeSheetsBackend, key: str):
+        self.backend = backend
+        self.id = key
+        self._worksheets = {}
+        self._next_id = 0
+
+    def _create(self, title: str, rows: int, cols: int) -> 'FakeWorksheet':
+        ws = FakeWorksheet(self.backend, self._next_id, title, rows, cols)
+        self._next_id += 1
+        self._worksheets[title] = ws
+        return ws
+
+    def worksheet(self, title: str) -> 'FakeWorksheet':
+        self.backend._call('worksheet')
+        if title not in self._worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self, exclude_hidden: bool = False) -> list:
+        self.backend._call('worksheets')
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows: int, cols: int, index=None) -> 'FakeWorksheet':
+        self.backend._call('add_worksheet')
+        if title in self._worksheets:
+            raise _api_error(400, 'INVALID_ARGUMENT', f'Sheet "{title}" already exists')
+        return self._create(title, rows, cols)
+
+    def del_worksheet(self, worksheet: 'FakeWorksheet'):
+        self.backend._call('del_worksheet')
+        self._worksheets.pop(worksheet.title, None)
+
+
+class FakeWorksheet:
+    def __init__(self, backend: FakeSheetsBackend, ws_id: int, title: str, rows: int, cols: int):
+        self.backend = backend
+        self.id = ws_id
+        self.title = title
+        self._row_count = rows
+        self.col_count = cols
+        self._rows = []
+        self.formats = []
+
+    @property
+    def row_count(self) -> int:
+        return max(self._row_count, len(self._rows))
+
+    def get_all_values(self, *args, **kwargs) -> list:
+        self.backend._call('get_all_values')
+        return [list(row) for row in self._rows]
+
+    def get(self, range_name: str = None, *args, **kwargs) -> list:
+        """Чтение диапазона строк 'A10:G20' (столбцы не обрезаются)"""
+        self.backend._call('get')
+        if not range_name:
+            return [list(row) for row in self._rows]
+        start, _, end = range_name.partition(':')
+        first = max(_row_index(start), 1)
+        last = _row_index(end) if end else first
+        if not last:
+            last = len(self._rows)
+        return [list(row) for row in self._rows[first - 1:last]]
+
+    def col_values(self, col: int, *args, **kwargs) -> list:
+        self.backend._call('col_values')
+        values = [row[col - 1] if len(row) >= col else '' for row in self._rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def add_cols(self, cols: int):
+        self.backend._call('add_cols')
+        self.col_count += cols
+
+    def append_row(self, values: list, value_input_option: str = 'RAW', **kwargs):
+        self.backend._call('append_row')
+        self._rows.append(['' if v is None else str(v) for v in values])
+
+    def append_rows(self, values: list, value_input_option: str = 'RAW', **kwargs):
+        self.backend._call('append_rows')
+        for row in values:
+            self._rows.append(['' if v is None else str(v) for v in row])
+
+    def format(self, ranges, format: dict):
+        self.backend._call('format')
+        self.formats.append((ranges, format))
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self.backend._call('delete_rows')
+        end_index = end_index or start_index
+        del self._rows[start_index - 1:end_index]
@@ -0,0 +1,56 @@
+"""Локальная подмена Telegram Bot API: сессия aiogram без сети."""
+import json
+import time
+import asyncio
+from collections import Counter
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message, User
+
+
+class FakeTelegramSession(BaseSession):
+    """Отвечает на любые методы Bot API правдоподобными ответами.
+
+    Ответ проходит через штатный check_response, поэтому стоимость
+    десериализации такая же, как у настоящей сессии.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        self.sent = []
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._build_result(bot, method)
+        content = json.dumps({'ok': True, 'result': result})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    def _build_result(self, bot, method):
+        returning = getattr(method, '__returning__', bool)
+        if returning is Message:
+            self._message_id += 1
+            chat_id = getattr(method, 'chat_id', 0)
+            text = getattr(method, 'text', None)
+            self.sent.append((chat_id, text))
+            return {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': text or '',
+            }
+        if returning is User:
+            return {'id': bot.id, 'is_bot': True, 'first_name': 'Parking', 'username': 'parking_load_bot'}
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
@@ -0,0 +1,86 @@
+"""Логирование без нагрузки на event loop.
+
+Обработчики и модули пишут в logging как обычно, но корневой логгер
+получает только QueueHandler: запись кладётся в очередь как есть, без
+форматирования, а форматирует (в JSON или текст) и пишет в stderr
+отдельный поток QueueListener. Строка сообщения собирается из
+logger.info("... %s", arg) уже в этом потоке.
+
+Частые INFO-записи можно прореживать: sample_rates задаёт долю
+пропускаемых записей по ключу — атрибуту sample из extra=... или имени
+логгера. Предупреждения и ошибки проходят всегда.
+"""
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import datetime
+import logging.handlers
+
+# Атрибуты LogRecord, которые не нужно дублировать в JSON как поля extra
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        item = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                item[key] = value
+        if record.exc_info:
+            item['exc'] = self.formatException(record.exc_info)
+        return json.dumps(item, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей уровня INFO и ниже для ключей из rates"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(getattr(record, 'sample', record.name))
+        return rate is None or random.random() < rate
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный prepare() форматирует запись в вызывающем потоке;
+    # очередь в том же процессе, поэтому запись можно передать как есть
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = 'INFO', fmt: str = 'json', sample_rates: dict = None):
+    """Настраивает корневой логгер; возвращает запущенный QueueListener"""
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    handler = _LazyQueueHandler(log_queue)
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Дописать очередь при выходе из процесса
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,126 @@
+"""Индекс гос. номеров для быстрого поиска по подстроке и нечёткого поиска.
+
+Номера приходят уже нормализованными (normalize_plate: без пробелов, верхний
+регистр, кириллица -> латиница). Для каждого номера строятся биграммы по
+"канонической" форме, где похожие символы (0/O, 8/B, 3/З ...) склеены в один —
+поэтому опечатка из таблицы CONFUSABLE_COST не ломает биграммы.
+
+Поиск по подстроке и нечёткий поиск сначала отбирают кандидатов по общим
+биграммам и только их проверяют точно: для нечёткого — расстоянием
+редактирования подстроки с весами из CONFUSABLE_COST.
+"""
+import math
+from collections import Counter
+
+# Стоимость замены похожих символов (остальные замены, вставка и пропуск — 1.0).
+# Дополняет RUS_TO_ENG из bot.py: там одинаковые по написанию буквы, здесь —
+# символы, которые путают при вводе по памяти или с фотографии.
+CONFUSABLE_COST = {
+    ('0', 'O'): 0.2,
+    ('8', 'B'): 0.3,
+    ('3', 'З'): 0.3,
+    ('4', 'Ч'): 0.5,
+    ('6', 'Б'): 0.5,
+    ('1', 'I'): 0.5,
+    ('7', 'T'): 0.7,
+}
+GAP_COST = 1.0
+
+_SUB_COST = {}
+for (a, b), cost in CONFUSABLE_COST.items():
+    _SUB_COST[a, b] = _SUB_COST[b, a] = cost
+
+# Символ -> представитель группы похожих символов
+_CANONICAL = {b: a for a, b in CONFUSABLE_COST}
+
+
+def canonical(plate: str) -> str:
+    return ''.join(_CANONICAL.get(ch, ch) for ch in plate)
+
+
+def _bigrams(text: str) -> list:
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+def substring_cost(query: str, plate: str, max_cost: float) -> float:
+    """Минимальная стоимость совпадения query с какой-либо подстрокой plate
+    (алгоритм Селлерса). Возвращает значение > max_cost, если дешевле нельзя."""
+    # prev[j] — стоимость совпадения первых i символов запроса, заканчивающегося на plate[j-1]
+    prev = [0.0] * (len(plate) + 1)
+    for i, q in enumerate(query, start=1):
+        cur = [i * GAP_COST]
+        for j, p in enumerate(plate, start=1):
+            sub = 0.0 if q == p else _SUB_COST.get((q, p), 1.0)
+            cur.append(min(prev[j - 1] + sub, prev[j] + GAP_COST, cur[j - 1] + GAP_COST))
+        if min(cur) > max_cost:
+            return max_cost + 1.0
+        prev = cur
+    return min(prev)
+
+
+class PlateIndex:
+    """entries: [(ref, нормализованный номер), ...]; ref возвращается в результатах"""
+
+    def __init__(self, entries):
+        self.refs = []
+        self.plates = []
+        self.grams = {}  # биграмма канонической формы -> [номер записи, ...]
+        for ref, plate in entries:
+            if not plate:
+                continue
+            pos = len(self.plates)
+            self.refs.append(ref)
+            self.plates.append(plate)
+            for gram in set(_bigrams(canonical(plate))):
+                self.grams.setdefault(gram, []).append(pos)
+
+    @classmethod
+    def from_parts(cls, refs, plates, grams) -> 'PlateIndex':
+        """Индекс из готовых частей (например, отображённых из файла снимка):
+        grams — любой объект с .get(биграмма, ()) -> последовательность позиций"""
+        index = cls.__new__(cls)
+        index.refs, index.plates, index.grams = refs, plates, grams
+        return index
+
+    def __len__(self) -> int:
+        return len(self.plates)
+
+    def _candidates(self, query: str, min_shared: int):
+        """Номера записей, у которых не меньше min_shared общих биграмм с запросом.
+        None — отбор бесполезен, нужен полный перебор."""
+        if min_shared <= 0:
+            return None
+        shared = Counter()
+        for gram in set(_bigrams(canonical(query))):
+            shared.update(self.grams.get(gram, ()))
+        return sorted(pos for pos, count in shared.items() if count >= min_shared)
+
+    def substring(self, query: str) -> list:
+        """ref всех номеров, содержащих query, в порядке индекса"""
+        if not query:
+            return []
+        candidates = self._candidates(query, len(set(_bigrams(canonical(query)))))
+        if candidates is None:
+            candidates = range(len(self.plates))
+        return [self.refs[pos] for pos in candidates if query in self.plates[pos]]
+
+    def fuzzy(self, query: str, max_cost: float) -> list:
+        """[(стоимость, ref), ...] номеров, похожих на query не дороже max_cost,
+        от самых похожих"""
+        if not query:
+            return []
+        # Каждая правка портит не больше двух биграмм запроса. Отбор считает
+        # различные биграммы ('77777' — одна '77'), поэтому и порог — от них.
+        # Замена похожих символов биграмм не меняет (канонической формой они
+        # склеены), а остальные правки стоят не меньше 1.0: бюджет 0.9 — ноль правок
+        edits = math.floor(max_cost / min(GAP_COST, 1.0) + 1e-9)
+        candidates = self._candidates(query, len(set(_bigrams(canonical(query)))) - 2 * edits)
+        if candidates is None:
+            candidates = range(len(self.plates))
+        matches = []
+        for pos in candidates:
+            cost = substring_cost(query, self.plates[pos], max_cost)
+            if cost <= max_cost:
+                matches.append((round(cost, 2), len(self.plates[pos]), pos))
+        matches.sort()
+        return [(cost, self.refs[pos]) for cost, _, pos in matches]
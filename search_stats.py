@@ -0,0 +1,137 @@
+"""Инкрементальная статистика поисков для админской команды /stats.
+
+Счётчики обновляются при каждой записи поиска и хранятся по месяцам —
+так же, как помесячные листы "Поиски ГГГГ-ММ", поэтому удаление старого
+листа просто удаляет его месяц из статистики. Состояние периодически
+сохраняется в JSON-файл; при необходимости его можно пересчитать из
+листов одним проходом (rebuild).
+"""
+import os
+import json
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class MonthStats:
+    def __init__(self):
+        self.total = 0
+        self.zero = 0
+        self.plates = Counter()   # нормализованный запрос -> число поисков
+        self.users = Counter()    # telegram_id -> число поисков
+        self.names = {}           # telegram_id -> @username / имя
+
+    def record(self, user_id: str, name: str, plate: str, found: int, max_keys: int):
+        self.total += 1
+        if not found:
+            self.zero += 1
+        self.plates[plate] += 1
+        self.users[user_id] += 1
+        if name:
+            self.names[user_id] = name
+        # Длинный хвост редких значений не нужен для топов — подрезаем
+        if len(self.plates) > 2 * max_keys:
+            self.plates = Counter(dict(self.plates.most_common(max_keys)))
+        if len(self.users) > 2 * max_keys:
+            self.users = Counter(dict(self.users.most_common(max_keys)))
+            self.names = {uid: self.names[uid] for uid in self.users if uid in self.names}
+
+    def to_dict(self) -> dict:
+        return {'total': self.total, 'zero': self.zero, 'plates': dict(self.plates),
+                'users': dict(self.users), 'names': self.names}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MonthStats':
+        stats = cls()
+        stats.total = data.get('total', 0)
+        stats.zero = data.get('zero', 0)
+        stats.plates = Counter(data.get('plates', {}))
+        stats.users = Counter(data.get('users', {}))
+        stats.names = data.get('names', {})
+        return stats
+
+
+class SearchStats:
+    def __init__(self, path: str, max_keys: int = 5000):
+        self.path = path
+        self.max_keys = max_keys
+        self._months = {}  # 'ГГГГ-ММ' -> MonthStats
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._months = {month: MonthStats.from_dict(item) for month, item in data.items()}
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка чтения статистики {self.path}: {e}")
+
+    def save(self):
+        """Атомарно сохраняет состояние, если оно менялось"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {month: stats.to_dict() for month, stats in self._months.items()}
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def record(self, month: str, user_id: str, name: str, plate: str, found: int):
+        with self._lock:
+            stats = self._months.setdefault(month, MonthStats())
+            stats.record(user_id, name, plate, found, self.max_keys)
+            self._dirty = True
+
+    def rebuild(self, rows) -> int:
+        """Пересчитывает всё по итератору (month, user_id, name, plate, found)
+        и подменяет состояние целиком. Возвращает число учтённых строк."""
+        months = {}
+        count = 0
+        for month, user_id, name, plate, found in rows:
+            stats = months.setdefault(month, MonthStats())
+            stats.record(user_id, name, plate, found, self.max_keys)
+            count += 1
+        with self._lock:
+            self._months = months
+            self._dirty = True
+        return count
+
+    def drop_month(self, month: str):
+        with self._lock:
+            if self._months.pop(month, None) is not None:
+                self._dirty = True
+
+    def months(self) -> list:
+        with self._lock:
+            return sorted(self._months)
+
+    def summary(self, months: list, top: int = 10) -> dict:
+        """Сводка по нескольким месяцам: итоги и топы"""
+        total = zero = 0
+        plates, users, names = Counter(), Counter(), {}
+        with self._lock:
+            for month in months:
+                stats = self._months.get(month)
+                if stats is None:
+                    continue
+                total += stats.total
+                zero += stats.zero
+                plates.update(stats.plates)
+                users.update(stats.users)
+                names.update(stats.names)
+        return {
+            'total': total,
+            'zero': zero,
+            'zero_rate': zero / total if total else 0.0,
+            'top_plates': plates.most_common(top),
+            'top_users': [(uid, names.get(uid, ''), count) for uid, count in users.most_common(top)],
+        }
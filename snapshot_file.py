@@ -0,0 +1,196 @@
+"""Снимок базы жильцов в файле, общий для нескольких процессов.
+
+Один процесс (бот) читает лист жильцов и записывает снимок вместе с
+индексом номеров в файл; остальные (web_server.py, воркеры API) отображают
+файл в память через mmap и читают его без копирования и без запросов к
+Sheets. Новая версия пишется во временный файл и подменяет старую через
+os.replace — читатель видит либо старый файл целиком, либо новый.
+
+Формат (little-endian, все секции выровнены по 4 байта):
+    заголовок HEADER: сигнатура, версия, число жильцов/номеров/биграмм,
+                      число зарегистрированных в боте (для /stats), смещения секций
+    user_offsets  u32 x (жильцов + 1)   — границы записей в users
+    users         записи "id␟номер␟ФИО␟телефон␟категория" в UTF-8
+    plate_users   u32 x номеров         — позиция жильца для каждого номера
+    plate_offsets u32 x (номеров + 1)
+    plates        нормализованные номера в UTF-8
+    gram_keys     8 байт x биграмм      — биграммы (UTF-8, дополнены нулями), по возрастанию
+    gram_offsets  u32 x (биграмм + 1)   — границы списков в postings
+    postings      u32                   — позиции номеров для каждой биграммы
+"""
+import os
+import mmap
+import struct
+
+from plate_index import PlateIndex
+
+MAGIC = b'PKSNAP02'
+HEADER = struct.Struct('<8sQIIII8Q')
+GRAM_WIDTH = 8
+USER_FIELDS = ('id', 'plate', 'fio', 'phone', 'category')
+FIELD_SEP = '\x1f'
+
+
+def _u32(values) -> bytes:
+    return struct.pack(f'<{len(values)}I', *values)
+
+
+def _blob(strings) -> tuple:
+    """(смещения, байты) для списка строк"""
+    offsets, parts, pos = [0], [], 0
+    for text in strings:
+        data = text.encode('utf-8')
+        parts.append(data)
+        pos += len(data)
+        offsets.append(pos)
+    return offsets, b''.join(parts)
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+
+def write_snapshot(path: str, version: int, users: list, index: PlateIndex, registered: int = 0):
+    """Атомарно записывает снимок: users — словари с полями USER_FIELDS,
+    index.refs — пары (позиция жильца, номер), registered — сколько жильцов в боте"""
+    user_offsets, users_blob = _blob(
+        FIELD_SEP.join(str(user.get(field, '')).replace(FIELD_SEP, ' ') for field in USER_FIELDS)
+        for user in users
+    )
+    plate_offsets, plates_blob = _blob(index.plates)
+    grams = sorted(index.grams.items(), key=lambda item: item[0].encode('utf-8'))
+    gram_offsets, postings = [0], []
+    for _, positions in grams:
+        postings.extend(positions)
+        gram_offsets.append(len(postings))
+
+    sections = [
+        _u32(user_offsets),
+        _pad(users_blob),
+        _u32([pos for pos, _ in index.refs]),
+        _u32(plate_offsets),
+        _pad(plates_blob),
+        b''.join(gram.encode('utf-8').ljust(GRAM_WIDTH, b'\0') for gram, _ in grams),
+        _u32(gram_offsets),
+        _u32(postings),
+    ]
+    offsets, pos = [], HEADER.size
+    for section in sections:
+        offsets.append(pos)
+        pos += len(section)
+    header = HEADER.pack(MAGIC, version, len(users), len(index.plates), len(grams), registered, *offsets)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_version(path: str) -> int:
+    """Версия снимка в файле (0, если файла нет или он не читается)"""
+    try:
+        with open(path, 'rb') as f:
+            magic, version, *_ = HEADER.unpack(f.read(HEADER.size))
+        return version if magic == MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+
+class _Strings:
+    """Последовательность строк поверх смещений и байтов в mmap"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+class _Users:
+    """Жильцы из снимка: словари создаются при обращении"""
+
+    def __init__(self, records: _Strings):
+        self._records = records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, i: int) -> dict:
+        return dict(zip(USER_FIELDS, self._records[i].split(FIELD_SEP)))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class _Refs:
+    """index.refs: (позиция жильца, номер)"""
+
+    def __init__(self, plate_users: memoryview, plates: _Strings):
+        self._plate_users = plate_users
+        self._plates = plates
+
+    def __len__(self) -> int:
+        return len(self._plate_users)
+
+    def __getitem__(self, pos: int) -> tuple:
+        return self._plate_users[pos], self._plates[pos]
+
+
+class _Grams:
+    """index.grams: биграмма -> позиции номеров, двоичный поиск по gram_keys"""
+
+    def __init__(self, keys: memoryview, offsets: memoryview, postings: memoryview):
+        self._keys = keys
+        self._offsets = offsets
+        self._postings = postings
+
+    def get(self, gram: str, default=()):
+        key = gram.encode('utf-8').ljust(GRAM_WIDTH, b'\0')
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self._keys[mid * GRAM_WIDTH:(mid + 1) * GRAM_WIDTH]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._offsets) - 1 and bytes(self._keys[lo * GRAM_WIDTH:(lo + 1) * GRAM_WIDTH]) == key:
+            return self._postings[self._offsets[lo]:self._offsets[lo + 1]]
+        return default
+
+
+class MappedSnapshot:
+    """Снимок, отображённый из файла: .version, .users, .index — как у
+    снимка в памяти, плюс .registered. Файл остаётся открытым, пока жив объект."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        magic, self.version, n_users, n_plates, n_grams, self.registered, *offsets = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не файл снимка")
+        (user_offsets, users_blob, plate_users, plate_offsets,
+         plates_blob, gram_keys, gram_offsets, postings) = offsets
+
+        def u32(start: int, count: int) -> memoryview:
+            return buf[start:start + 4 * count].cast('I')
+
+        plates = _Strings(u32(plate_offsets, n_plates + 1), buf[plates_blob:gram_keys])
+        self.users = _Users(_Strings(u32(user_offsets, n_users + 1), buf[users_blob:plate_users]))
+        self.index = PlateIndex.from_parts(
+            _Refs(u32(plate_users, n_plates), plates),
+            plates,
+            _Grams(buf[gram_keys:gram_offsets], u32(gram_offsets, n_grams + 1),
+                   u32(postings, (len(buf) - postings) // 4))
+        )
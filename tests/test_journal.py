@@ -0,0 +1,88 @@
+"""Журнал записей: досылка после падения без дублей и сжатие файла."""
+import pytest
+
+from journal import SheetsJournal
+
+
+class FakeWorksheet:
+    """Минимум gspread.Worksheet, который нужен журналу"""
+
+    def __init__(self):
+        self.rows = []
+        self.col_count = 2
+        self.fail_after_append = False
+
+    def col_values(self, col):
+        return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+
+    def add_cols(self, n):
+        self.col_count += n
+
+    def append_rows(self, rows, value_input_option=None):
+        self.rows.extend(rows)
+        if self.fail_after_append:
+            # Запрос выполнился, а ответ потерялся
+            self.fail_after_append = False
+            raise ConnectionError('connection reset')
+
+
+def line_count(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for _ in f)
+
+
+def test_replay_after_crash_before_ack_sends_each_row_once(tmp_path):
+    path = str(tmp_path / 'journal.log')
+    ws = FakeWorksheet()
+    journal = SheetsJournal(path)
+    keys = [journal.append('Поиски', [f'2026-10-19 10:00:0{i}', str(i)]) for i in range(3)]
+    journal.sync()
+
+    # Строки дошли до Sheets, но процесс упал до записи подтверждения
+    def crash(acked):
+        raise SystemExit
+    journal._ack = crash
+    with pytest.raises(SystemExit):
+        journal.replay(lambda title: ws)
+    assert len(ws.rows) == 3
+
+    restarted = SheetsJournal(path)
+    assert len(restarted) == 3 and restarted.needs_verify
+    assert restarted.replay(lambda title: ws) == 3
+    assert [row[-1] for row in ws.rows] == keys
+    assert len(restarted) == 0 and not restarted.needs_verify
+    assert len(SheetsJournal(path)) == 0
+
+
+def test_replay_after_lost_response_verifies_keys(tmp_path):
+    ws = FakeWorksheet()
+    journal = SheetsJournal(str(tmp_path / 'journal.log'))
+    for i in range(3):
+        journal.append('Поиски', [str(i)])
+    ws.fail_after_append = True
+    with pytest.raises(ConnectionError):
+        journal.replay(lambda title: ws)
+    assert journal.needs_verify
+
+    journal.append('Поиски', ['3'])
+    assert journal.replay(lambda title: ws) == 4
+    assert [row[0] for row in ws.rows] == ['0', '1', '2', '3']
+
+
+def test_file_is_compacted_under_steady_traffic(tmp_path):
+    path = str(tmp_path / 'journal.log')
+    ws = FakeWorksheet()
+    journal = SheetsJournal(path, compact_after=20)
+    for i in range(5):
+        journal.append('Поиски', [str(i)])
+    # Каждую отправку догоняют новые записи — журнал никогда не пустеет
+    for i in range(5, 300):
+        journal.append('Поиски', [str(i)])
+        journal.replay(lambda title: ws, batch_size=1)
+        assert line_count(path) <= len(journal) + 2 * journal.compact_after
+    journal.sync()
+
+    restarted = SheetsJournal(path)
+    assert restarted.pending_items('Поиски') == journal.pending_items('Поиски')
+    restarted.replay(lambda title: ws)
+    assert [row[0] for row in ws.rows] == [str(i) for i in range(300)]
@@ -0,0 +1,44 @@
+"""Индекс номеров должен находить ровно то же, что полный перебор."""
+import random
+
+import pytest
+
+from plate_index import PlateIndex, substring_cost
+
+PLATES = ['A7777B77', 'M0000O77', 'O808OO99', 'A777AA177', 'B123CX50', 'E3344K199', 'T777TT77', 'X001XX01']
+
+
+def brute_fuzzy(plates, query, max_cost):
+    matches = []
+    for pos, plate in enumerate(plates):
+        cost = substring_cost(query, plate, max_cost)
+        if cost <= max_cost:
+            matches.append((round(cost, 2), len(plate), pos))
+    return [(cost, pos) for cost, _, pos in sorted(matches)]
+
+
+@pytest.mark.parametrize('query,max_cost', [
+    ('77777', 1.0), ('00000', 1.0), ('OOOOO', 1.0), ('A77777', 1.0),
+    ('0B0B', 1.0), ('B123', 0.5), ('3344', 1.0), ('X0O1', 1.0),
+    ('7O7', 0.9), ('B0O', 0.9), ('T77', 0.9), ('00O', 0.9),
+])
+def test_fuzzy_matches_brute_force(query, max_cost):
+    index = PlateIndex((pos, plate) for pos, plate in enumerate(PLATES))
+    assert index.fuzzy(query, max_cost) == brute_fuzzy(PLATES, query, max_cost)
+
+
+def test_fuzzy_and_substring_match_brute_force_on_random_plates():
+    rng = random.Random(7)
+    alphabet = 'ABEKMHOPCTYX0123456789'
+    plates = [''.join(rng.choice(alphabet) for _ in range(rng.randint(6, 9))) for _ in range(300)]
+    index = PlateIndex((pos, plate) for pos, plate in enumerate(plates))
+    for _ in range(200):
+        plate = rng.choice(plates)
+        start = rng.randint(0, len(plate) - 3)
+        query = plate[start:start + rng.randint(3, 5)]
+        if rng.random() < 0.5:
+            i = rng.randrange(len(query))
+            query = query[:i] + rng.choice(alphabet) + query[i + 1:]
+        assert index.fuzzy(query, 1.0) == brute_fuzzy(plates, query, 1.0)
+        assert index.fuzzy(query[:3], 0.9) == brute_fuzzy(plates, query[:3], 0.9)
+        assert index.substring(query) == [pos for pos, p in enumerate(plates) if query in p]